@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# tellie_bench.py
+#
+# Benchmarks of the tellie control server against an
+# emulated SNO6C (core/sno6c_emulator.py), directly and
+# over xmlrpc:
+#   setup_single       one channel set up from scratch (s)
+#   setup_sweep        all 95 channels set up in turn (s)
+#   fire_read          short fire and read cycles (per s)
+#   multi_segment      a 200k pulse run in 4 segments (s)
+#   concurrent         8 clients setting up and polling (calls per s, p90 s)
+#
+# Results are written as JSON, and compared with a stored
+# baseline: anything worse than the baseline by more than
+# the tolerance is reported and the exit code is 1.
+#   python bench/tellie_bench.py -o results.json
+#   python bench/tellie_bench.py --save-baseline
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from core import sno6c_emulator, tellie_server, rpc_server
+from common import rpc_client
+from common import parameters as p
+
+_baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+_n_channels = 95
+_concurrent_clients = 8
+
+
+def channel_settings(channel, width):
+    return [["channel", channel],
+            ["pulse_height", p._max_pulse_height],
+            ["pulse_width", width],
+            ["fibre_delay", 0.]]
+
+
+def bench_setup_single(tellie, repeats=20):
+    """Mean time to set up one channel, all settings changing"""
+    start = time.time()
+    for i in range(repeats):
+        channel = 1 + i % 2
+        tellie.set_settings(channel_settings(channel, 1000 + i) +
+                            [["pulse_number", 1000 * (1 + i % 2)], ["pulse_delay", 1.0 + i % 2], ["trigger_delay", 0]])
+    return (time.time() - start) / repeats
+
+
+def bench_setup_sweep(tellie, width):
+    """Time to set up every channel in turn (width must differ between runs)"""
+    start = time.time()
+    for channel in range(1, _n_channels + 1):
+        tellie.set_settings(channel_settings(channel, width + channel))
+    return time.time() - start
+
+
+def bench_fire_read(tellie, repeats=20):
+    """Short sequences fired and read per second"""
+    tellie.set_settings(channel_settings(1, 1000) +
+                        [["pulse_number", 10], ["pulse_delay", p._min_pulse_delay], ["trigger_delay", 0]])
+    start = time.time()
+    for i in range(repeats):
+        tellie.fire_sequence_and_read()
+    return repeats / (time.time() - start)
+
+
+def bench_multi_segment(tellie):
+    """Time to fire 200k pulses on one channel in 4 segments"""
+    tellie.set_settings(channel_settings(1, 1000))
+    segment = {"channels": [1], "pulse_number": 50000,
+               "pulse_delay": p._min_pulse_delay, "trigger_delay": 0}
+    start = time.time()
+    tellie.fire_plan([segment] * 4)
+    return time.time() - start
+
+
+def bench_concurrent(address, repeats=10):
+    """Clients each setting up a channel and polling the settings, returns
+    the total calls per second and the 90th percentile poll latency.
+    """
+    latencies = []
+    def client(channel):
+        proxy = rpc_client.server_proxy(*address)
+        for i in range(repeats):
+            proxy.set_settings(channel_settings(channel, 3000 + i))
+            for j in range(4):
+                start = time.time()
+                proxy.get_settings_cache()
+                latencies.append(time.time() - start)
+        proxy("close")()
+    threads = [threading.Thread(target=client, args=(channel,))
+               for channel in range(1, _concurrent_clients + 1)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    latencies.sort()
+    return (_concurrent_clients * repeats * 5 / elapsed,
+            latencies[int(0.9 * len(latencies))])
+
+
+def run(time_scale):
+    """Run every benchmark, returns {name: {"value", "unit", "better"}}"""
+    results = {}
+    def add(name, value, unit, better):
+        results[name] = {"value": value, "unit": unit, "better": better}
+        print "%-28s %10.4f %s" % (name, value, unit)
+
+    emulator = sno6c_emulator.PtyEmulator(sno6c_emulator.SNO6CEmulator(seed=1, time_scale=time_scale))
+    emulator.start()
+    tellie = tellie_server.SerialCommand(emulator.port_name)
+    add("direct.setup_single", bench_setup_single(tellie), "s", "lower")
+    add("direct.setup_sweep", bench_setup_sweep(tellie, 2000), "s", "lower")
+    add("direct.fire_read", bench_fire_read(tellie), "per_s", "higher")
+    add("direct.multi_segment", bench_multi_segment(tellie), "s", "lower")
+
+    server, executor = rpc_server.make_server(tellie, "localhost", 0, concurrent=True)
+    address = server.server_address
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    proxy = rpc_client.server_proxy(*address)
+    add("rpc.setup_single", bench_setup_single(proxy), "s", "lower")
+    add("rpc.setup_sweep", bench_setup_sweep(proxy, 4000), "s", "lower")
+    add("rpc.fire_read", bench_fire_read(proxy), "per_s", "higher")
+    rate, p90 = bench_concurrent(address)
+    add("rpc.concurrent_rate", rate, "per_s", "higher")
+    add("rpc.concurrent_poll_p90", p90, "s", "lower")
+    proxy("close")()
+    server.shutdown()
+    server.server_close()
+    emulator.stop()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Get a message for each result worse than the baseline by more
+    than the tolerance (a fraction of the baseline value).
+    """
+    regressions = []
+    for name, base in sorted(baseline["results"].iteritems()):
+        if name not in results:
+            continue
+        value = results[name]["value"]
+        if base["better"] == "lower":
+            limit = base["value"] * (1 + tolerance)
+            worse = value > limit
+        else:
+            limit = base["value"] * (1 - tolerance)
+            worse = value < limit
+        if worse:
+            regressions.append("%s: %.4f %s, baseline %.4f (limit %.4f)" %
+                               (name, value, base["unit"], base["value"], limit))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", dest="output", default=None, help="Write the results to this JSON file")
+    parser.add_argument("-b", dest="baseline", default=_baseline_file, help="Baseline JSON file")
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=0.25, help="Allowed fractional regression")
+    parser.add_argument("--time-scale", dest="time_scale", type=float, default=0.01, help="Emulated pulse train time scale")
+    parser.add_argument("--save-baseline", dest="save_baseline", action="store_true", help="Store these results as the baseline")
+    args = parser.parse_args()
+
+    output = {"time": time.time(),
+              "time_scale": args.time_scale,
+              "flow_control": p._flow_control,
+              "reader_thread": p._reader_thread,
+              "serial_engine": p._serial_engine,
+              "results": run(args.time_scale)}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+        print "Saved baseline %s" % (args.baseline)
+        sys.exit(0)
+    if not os.path.exists(args.baseline):
+        print "No baseline %s to compare with" % (args.baseline)
+        sys.exit(0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(output["results"], baseline, args.tolerance)
+    for regression in regressions:
+        print "REGRESSION %s" % (regression)
+    if regressions:
+        sys.exit(1)
+    print "No regressions (tolerance %d%%)" % (args.tolerance * 100)
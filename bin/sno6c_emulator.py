@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+# sno6c_emulator.py
+#
+# Run an emulated SNO6C control box on a pseudo-terminal,
+# then point the server at it, e.g.:
+#   python bin/sno6c_emulator.py
+#   python bin/tellie.py -s /dev/pts/3
+# or on a TCP port, like a ser2net bridge:
+#   python bin/sno6c_emulator.py --tcp 7000
+#   python bin/tellie.py -s socket://localhost:7000
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import argparse
+import time
+from core import sno6c_emulator
+from common import parameters as p
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-l", dest="echo_latency", type=float, default=p._echo_latency, help="Echo latency (s)")
+    parser.add_argument("-t", dest="time_scale", type=float, default=1., help="Scale the duration of pulse trains")
+    parser.add_argument("--drop", dest="drop_echo", type=float, default=0., help="Probability of dropping an echo")
+    parser.add_argument("--corrupt", dest="corrupt_echo", type=float, default=0., help="Probability of corrupting an echo")
+    parser.add_argument("--power-loss", dest="power_loss", type=float, default=0., help="Probability of a power loss per command")
+    parser.add_argument("--tcp", dest="tcp_port", type=int, default=None, help="Serve on this TCP port instead of a pty")
+    parser.add_argument("--seed", dest="seed", type=int, default=None, help="Random seed")
+    args = parser.parse_args()
+
+    faults = {sno6c_emulator.DROP_ECHO: args.drop_echo,
+              sno6c_emulator.CORRUPT_ECHO: args.corrupt_echo,
+              sno6c_emulator.POWER_LOSS: args.power_loss}
+    emulator = sno6c_emulator.SNO6CEmulator(args.echo_latency, faults, args.seed,
+                                            time_scale=args.time_scale)
+    if args.tcp_port is not None:
+        server = sno6c_emulator.SocketEmulator(emulator, "", args.tcp_port)
+        port_name = "socket://<host>:%d" % (args.tcp_port)
+    else:
+        server = sno6c_emulator.PtyEmulator(emulator)
+        port_name = server.port_name
+    server.start()
+    print "Emulated SNO6C on %s" % (port_name)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print "Exiting"
+        server.stop()
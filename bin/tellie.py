@@ -17,21 +17,28 @@ import os
 import sys
 import argparse
 import inspect
-from SimpleXMLRPCServer import SimpleXMLRPCServer
-from core import tellie_exception, tellie_server
+import threading
+from core import tellie_exception, tellie_server, rpc_server, event_publisher, metrics, orca_comms
 from common import tellie_logger
 from common import parameters as p
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-d", dest="debug", action="store_true", default=p._debug_mode, help="Debug mode")
+    parser.add_argument("--trace", dest="trace", action="store_true", default=p._trace_mode, help="Trace every serial read/write")
     parser.add_argument("-p", dest="server_port", type=int, default=p._server_port, help="XMLRPC server port")
-    parser.add_argument("-s", dest="serial_port", default=p._serial_port, help="Set TELLIE usb port")
+    parser.add_argument("-c", dest="concurrent", action="store_true", default=p._concurrent_server, help="Serve clients concurrently")
+    parser.add_argument("-e", dest="event_port", type=int, default=p._event_port, help="Event subscription port (0 to disable)")
+    parser.add_argument("-o", dest="orca_port", type=int, default=p._orca_port, help="Orca socket protocol port (0 to disable)")
+    parser.add_argument("-s", dest="serial_port", default=p._serial_port, help="Set TELLIE usb port or URL (socket://host:port, rfc2217://host:port, emulator://)")
     parser.add_argument("-t", dest="chip_type", default=p._chip_type, help="Select TELLIE chip type")
+    parser.add_argument("-w", dest="warm_start", action="store_true", help="Warm start: skip the reset and test pulse if the box responds")
+    parser.add_argument("--record", dest="record", default=None, help="Record all serial traffic to this file")
     parser.add_argument("-l", dest="logfile", default=p._logger_file, help="Log filename")
     args = parser.parse_args()
     logger = tellie_logger.TellieLogger.get_instance()
     logger.set_debug_mode(args.debug)
+    logger.set_trace_mode(args.trace)
     logger.set_log_file(args.logfile)
 
     # Dynamically load the correct class for the chip
@@ -47,7 +54,7 @@ if __name__ == "__main__":
 
     # Now try to open up the connection with the correct usb-serial port
     try:
-        tellie_control = command_class(args.serial_port)
+        tellie_control = command_class(args.serial_port, warm_start=args.warm_start, record=args.record)
     except tellie_exception.TellieSerialException:
         print "Could not connect on serial port %s" % (args.serial_port)
         ports = []
@@ -67,9 +74,21 @@ if __name__ == "__main__":
         raise
 
     # Begin an endless loop with safe exits in the case of errors / interrupts
-    server = SimpleXMLRPCServer(("localhost", args.server_port), allow_none=True)
-    server.register_instance(tellie_control)
-    print "serving..."
+    # All servers are local only, none authenticate their clients
+    host = "localhost"
+    if args.event_port:
+        event_publisher.EventPublisher.get_instance().listen(host, args.event_port)
+        print "publishing events on port %d" % (args.event_port)
+    if p._metrics_interval > 0:
+        metrics.MetricsDumper().start()
+    if args.orca_port:
+        orca_thread = threading.Thread(target=orca_comms.serve, name="OrcaServer",
+                                       args=(host, args.orca_port, tellie_control))
+        orca_thread.daemon = True
+        orca_thread.start()
+        print "serving Orca on port %d" % (args.orca_port)
+    server, executor = rpc_server.make_server(tellie_control, host, args.server_port, args.concurrent)
+    print "serving%s..." % (" (concurrent)" if args.concurrent else "")
     try:
         server.serve_forever()
     except KeyboardInterrupt, e:
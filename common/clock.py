@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+#
+# clock
+#
+# RealClock, VirtualClock
+#
+# The time source used for tellie's pauses and timeouts.
+# Code takes a clock (time, sleep and wait) rather than
+# calling the time module, so that paired with an
+# emulated box (see core/sno6c_emulator.py) whole runs
+# can go in virtual time, e.g. a full campaign in
+# seconds:
+#
+#   virtual = clock.VirtualClock()
+#   sc = tellie_server.SerialCommand("emulator://", use_reader=False, clock=virtual)
+#
+# Virtual time only moves when something sleeps or waits,
+# so is meant for single threaded runs: polling the port
+# or the transaction engine, SerialCommand refuses a
+# virtual clock with the reader thread.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import threading
+import time
+
+
+class RealClock(object):
+    """Wall clock time"""
+
+    virtual = False
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self, waitable, timeout):
+        """Wait on a threading Event or Condition for up to timeout"""
+        return waitable.wait(timeout)
+
+
+class VirtualClock(object):
+    """Time that moves on at once by however long is slept"""
+
+    virtual = True
+
+    def __init__(self, start=0.):
+        self._now = start
+        self._lock = threading.Lock()
+
+    def time(self):
+        return self._now
+
+    def sleep(self, seconds):
+        with self._lock:
+            self._now += max(seconds, 0)
+
+    def wait(self, waitable, timeout):
+        """Return straight away if an Event is set, otherwise move on by
+        the timeout (nothing else can set it meanwhile)
+        """
+        is_set = getattr(waitable, "is_set", None)
+        if is_set and is_set():
+            return True
+        self.sleep(timeout)
+        return is_set() if is_set else None
+
+
+# Shared default
+real_clock = RealClock()
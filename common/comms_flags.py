@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# comms_flags
+#
+# Flags of the Orca <-> tellie socket protocol served by
+# core/orca_comms.py (bin/tellie.py -o port).
+#
+# The Orca side definitions of these flags are not part
+# of this repository, so this is a protocol of its own:
+# the values below define it, and Orca clients must use
+# them (see orca_side/orca_scripts/tellie_socket_script.py).
+#
+# Requests and responses are each one line, ending in a
+# newline.  A request is a flag, followed by '|' and a
+# JSON payload for the flags that take one; a response
+# is a flag, optionally followed by '|' and its detail.
+# Responses come in the order of the requests.
+#
+#   I|{"<channel>": {"pulse_height": h, "pulse_width": w,
+#                    "fibre_delay": d}, ...}
+#       -> READY
+#   F|{"channels": [c, ...], "pulse_number": n,
+#      "pulse_delay": ms, "trigger_delay": ns}
+#       -> FIRING
+#   R   -> PINOUT|pin, or NOTREADY if the sequence has not
+#          finished within orca_read_timeout
+#   S   -> STOPPED|buffer contents (requests queued at
+#          the time fail with ERROR)
+#   Q   -> STATS|{"<host>:<port>": {"queued": q,
+#                 "in_flight": f, "completed": c}, ...}
+#          the requests of each open connection queued,
+#          running (including PIN reads waiting for the
+#          readout) and answered.  The Q request itself
+#          is answered at once and is not counted.
+#   any request can fail with ERROR|message
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+# Requests from Orca
+orca_init = "I"      # I|{settings}: load the channel settings
+orca_fire = "F"      # F|{settings}: fire the loaded channels
+orca_read = "R"      # read the PIN of the last sequence
+orca_stop = "S"      # stop firing
+orca_stats = "Q"     # request counts of each connection
+
+# Responses from tellie
+tellie_ready = "READY"
+tellie_firing = "FIRING"
+tellie_pinout = "PINOUT"        # PINOUT|pin
+tellie_notready = "NOTREADY"    # no PIN readout (yet)
+tellie_stopped = "STOPPED"      # STOPPED|buffer contents
+tellie_stats = "STATS"          # STATS|{client: {stats}, ...}
+tellie_error = "ERROR"          # ERROR|message
+
+
+def valid_pin(pin, channels):
+    """Check a PIN readout is a number from a single channel"""
+    if len(channels) != 1:
+        return False
+    try:
+        float(pin)
+    except (TypeError, ValueError):
+        return False
+    return True
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+#
+# fire_plan
+#
+# combine_segments
+#
+# A firing plan is a list of sequence segments, each
+# on one channel.  The server fires them (fire_plan) and
+# the GUI may fire them one at a time, both combine the
+# per-segment PIN/RMS here as if each channel had fired
+# one long sequence.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import math
+
+
+def combine_segments(results):
+    """Combine segment results, dicts with "channel", "pulse_number",
+    "pin" and "rms".  Returns the segments and the pulse weighted PIN/RMS
+    and pulse count of each channel (keyed by channel string for xmlrpc).
+    """
+    totals = {}
+    for result in results:
+        channel = str(result["channel"])
+        n, pin_sum, sq_sum = totals.get(channel, (0, 0., 0.))
+        n += result["pulse_number"]
+        pin_sum += result["pulse_number"] * result["pin"]
+        sq_sum += result["pulse_number"] * (result["rms"]**2 + result["pin"]**2)
+        totals[channel] = (n, pin_sum, sq_sum)
+    plan = {"segments": results, "pulse_number": {}, "pin": {}, "rms": {}}
+    for channel, (n, pin_sum, sq_sum) in totals.iteritems():
+        mean = pin_sum / n
+        plan["pulse_number"][channel] = n
+        plan["pin"][channel] = mean
+        plan["rms"][channel] = math.sqrt(max(sq_sum / n - mean**2, 0.))
+    return plan
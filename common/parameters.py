@@ -22,6 +22,9 @@ for path in paths:
 # Connection to host
 _serial_port = str(config.get('CONNECTION', 'serial_port'))
 _server_port = config.getint('CONNECTION', 'server_port')
+_concurrent_server = config.getboolean('CONNECTION', 'concurrent_server')
+_event_port = config.getint('CONNECTION', 'event_port')
+_orca_port = config.getint('CONNECTION', 'orca_port')
 _logger_port = config.getint('CONNECTION', 'logger_port')
 _logger_file = str(config.get('CONNECTION', 'logger_file'))
 _server_log = str(config.get('CONNECTION', 'server_log'))
@@ -31,11 +34,31 @@ _scope_name = str(config.get('CONNECTION', 'scope_name'))
 
 # Parameters for read/write commands
 _debug_mode = config.getboolean('PARAMETERS', 'debug_mode')
+_trace_mode = config.getboolean('PARAMETERS', 'trace_mode')
 _buffer_pause = config.getfloat('PARAMETERS', 'buffer_pause')
 _short_pause = config.getfloat('PARAMETERS', 'short_pause')
 _medium_pause = config.getfloat('PARAMETERS', 'medium_pause')
 _long_pause = config.getfloat('PARAMETERS', 'long_pause')
 _read_bytes = config.getint('PARAMETERS', 'read_bytes')
+_sequence_overhead = config.getfloat('PARAMETERS', 'sequence_overhead')
+_recovery_retries = config.getint('PARAMETERS', 'recovery_retries')
+_recovery_backoff = config.getfloat('PARAMETERS', 'recovery_backoff')
+_temp_scan_interval = config.getfloat('PARAMETERS', 'temp_scan_interval')
+_temp_history = config.getint('PARAMETERS', 'temp_history')
+_orca_read_timeout = config.getfloat('PARAMETERS', 'orca_read_timeout')
+_orca_poll = config.getfloat('PARAMETERS', 'orca_poll')
+_orca_queue_size = config.getint('PARAMETERS', 'orca_queue_size')
+_orca_max_in_flight = config.getint('PARAMETERS', 'orca_max_in_flight')
+_event_queue_size = config.getint('PARAMETERS', 'event_queue_size')
+_metrics_samples = config.getint('PARAMETERS', 'metrics_samples')
+_metrics_file = config.get('PARAMETERS', 'metrics_file')
+_metrics_interval = config.getfloat('PARAMETERS', 'metrics_interval')
+_flow_control = str(config.get('PARAMETERS', 'flow_control'))
+_echo_poll = config.getfloat('PARAMETERS', 'echo_poll')
+_echo_latency = config.getfloat('PARAMETERS', 'echo_latency')
+_reader_thread = config.getboolean('PARAMETERS', 'reader_thread')
+_reader_ring_size = config.getint('PARAMETERS', 'reader_ring_size')
+_serial_engine = config.getboolean('PARAMETERS', 'serial_engine')
 
 # Pulse settings (defaults only, you can still set them at runtime)
 _pulse_num = config.getint('PULSING', 'pulse_num')
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+#
+# rpc_client
+#
+# KeepAliveTransport, Batch
+#
+# Helpers for clients of the tellie xmlrpc server:
+# a proxy that reuses its HTTP connection between calls
+# (one connection per thread) and batches of calls that
+# are sent to the server in a single request.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import threading
+import xmlrpclib
+from common import parameters as p
+
+
+class KeepAliveTransport(xmlrpclib.Transport, object):
+    """Transport keeping one persistent connection per thread, so the
+    proxy can be shared between e.g. a GUI and its worker threads.
+    """
+
+    def __init__(self, use_datetime=0):
+        self._local = threading.local()
+        xmlrpclib.Transport.__init__(self, use_datetime)
+
+    @property
+    def _connection(self):
+        return getattr(self._local, "connection", (None, None))
+
+    @_connection.setter
+    def _connection(self, connection):
+        self._local.connection = connection
+
+
+def server_proxy(host="localhost", port=p._server_port):
+    """Get a proxy for the tellie server, reusing connections between calls.
+    Connections are only kept open by servers running in concurrent mode.
+    """
+    return xmlrpclib.ServerProxy("http://%s:%s" % (host, port),
+                                 transport=KeepAliveTransport(), allow_none=True)
+
+
+class Batch(object):
+    """Collect calls and send them in one request, e.g.:
+
+        batch = Batch(server)
+        batch.select_channel(1)
+        batch.set_pulse_width(0)
+        channel, width = batch()
+
+    Results are returned as an iterator, which raises a Fault when it
+    reaches a call that failed (calls after it were not run).
+    """
+
+    def __init__(self, server):
+        self._server = server
+        self._calls = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        def add_call(*params):
+            self._calls.append([name, params])
+        return add_call
+
+    def __call__(self):
+        calls, self._calls = self._calls, []
+        return xmlrpclib.MultiCallIterator(self._server.batch(calls))
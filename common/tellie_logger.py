@@ -19,14 +19,14 @@ import time
 
 def log_message(message, log_file=None, colour=None):
     '''Print a message, log to file as well if possible.
+
+    log_file is an open file (see TellieLogger for the day's file).
     '''
     curtime = time.strftime("%Y/%m/%d-%H:%M:%S")
     output = curtime + ": " + message
     if log_file is not None:
-        curday = time.strftime("_%Y_%m_%d")
-        log_file = log_file + curday + '.log'
-        f = open(log_file, 'a')
-        f.write(output + '\n')
+        log_file.write(output + '\n')
+        log_file.flush()
     if colour is not None:
         output = colour + output + '\033[0m'
     print output
@@ -58,7 +58,11 @@ class TellieLogger:
             raise Exception("Only one logger allowed")
         TellieLogger._instance = self
         self._debug_mode = False
+        self._trace_mode = False
         self._log_file = None
+        # Keep the day's log file open rather than re-opening per message
+        self._file = None
+        self._file_name = None
         self._colwarn = '\033[91m'
         self._colerr = '\033[41m'
         self._coldbg = '\033[21m'
@@ -66,18 +70,55 @@ class TellieLogger:
     def set_debug_mode(self, debug_mode):
         self._debug_mode = debug_mode
 
+    def set_trace_mode(self, trace_mode):
+        """Trace mode logs every serial read/write, separately from debug"""
+        self._trace_mode = trace_mode
+
+    def debug_enabled(self):
+        """Cheap check to make before formatting a debug message"""
+        return self._debug_mode
+
+    def trace_enabled(self):
+        """Cheap check to make before formatting a trace message"""
+        return self._trace_mode
+
     def set_log_file(self, log_file):
         self._log_file = log_file
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._file_name = None
+
+    def _log_message(self, message, colour=None):
+        """log_message to the open file for the current day"""
+        if self._log_file is not None:
+            file_name = self._log_file + time.strftime("_%Y_%m_%d") + '.log'
+            if file_name != self._file_name:
+                if self._file is not None:
+                    self._file.close()
+                try:
+                    self._file = open(file_name, 'a')
+                except IOError, e:
+                    # e.g. the server_log directory of another machine, keep printing
+                    print "Cannot open log file, logging to screen only: %s" % (e)
+                    self._log_file = None
+                    self._file = None
+                self._file_name = file_name
+        log_message(message, self._file, colour)
 
     def log(self, message):
-        log_message(message, self._log_file)
+        self._log_message(message)
 
     def notice(self, message):
-        log_message("NOTICE: " + message, self._log_file)
+        self._log_message("NOTICE: " + message)
         
     def debug(self, message):
         if self._debug_mode:
-            log_message("DEBUG: " + message, self._log_file, self._coldbg)
+            self._log_message("DEBUG: " + message, self._coldbg)
+
+    def trace(self, message):
+        if self._trace_mode:
+            self._log_message("TRACE: " + message, self._coldbg)
 
     def warn(self, message):
-        log_message("WARN: " + message, self._log_file, self._colwarn)
+        self._log_message("WARN: " + message, self._colwarn)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#
+# campaign_scheduler
+#
+# Functions to order the points of a calibration
+# campaign so that as few settings as possible need
+# to be re-sent to the tellie control box, and to
+# predict how long the campaign will take.
+#
+# A point is a dict of settings, e.g.:
+#   {"channel": 1, "pulse_width": 1000, "pulse_height": 16383,
+#    "pulse_number": 1000, "pulse_delay": 1.0, "trigger_delay": 0,
+#    "fibre_delay": 0.}
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import copy
+import itertools
+import tellie_server
+from common import parameters as p
+
+
+def make_points(channels, pulse_widths, pulse_delays, pulse_numbers, **fixed):
+    """Get the full cross product of campaign points.
+    Any other settings (e.g. pulse_height) are passed as keywords.
+    """
+    points = []
+    for channel, width, delay, number in itertools.product(channels, pulse_widths,
+                                                           pulse_delays, pulse_numbers):
+        point = dict(fixed)
+        point.update({"channel": channel,
+                      "pulse_width": width,
+                      "pulse_delay": delay,
+                      "pulse_number": number})
+        points.append(point)
+    return points
+
+
+def point_targets(point):
+    """Convert a point to targets for tellie_server.minimal_settings"""
+    targets = {"channel": point["channel"],
+               "channel_settings": {str(point["channel"]): {}}}
+    for name in tellie_server.global_settings:
+        if name in point:
+            targets[name] = point[name]
+    for name in tellie_server.channel_settings:
+        if name in point:
+            targets["channel_settings"][str(point["channel"])][name] = point[name]
+    return targets
+
+
+def apply_to_cache(cache, settings):
+    """Model of the SerialCommand settings cache after sending settings"""
+    cache = copy.deepcopy(cache)
+    cache.setdefault("channel_settings", {})
+    for name, value in settings:
+        if name == "channel":
+            cache["channels"] = [value]
+        elif name in tellie_server.global_settings:
+            cache[name] = value
+        else:
+            channel = str(cache["channels"][0])
+            cache["channel_settings"].setdefault(channel, {})[name] = value
+    cache["force_setting"] = False # lifted by the fire command
+    return cache
+
+
+def fire_time(point):
+    """Expected time (s) to fire and read out a point"""
+    sequence = point["pulse_number"] * (point["pulse_delay"] * 1e-3 + p._sequence_overhead)
+    # fire_sequence disables the external trigger and sleeps after the fire command
+    return sequence + p._echo_latency + p._short_pause
+
+
+def setting_orders(points):
+    """Candidate orders of settings to sort points by: the global settings
+    from most to least costly to change either outside or inside the
+    channel.  Channel settings always come last as they are cached per
+    channel.
+    """
+    costs = {}
+    for name in tellie_server.global_settings:
+        values = [point[name] for point in points if name in point]
+        if values:
+            costs[name] = tellie_server.estimate_settings_time([[name, values[0]]])
+    globals_order = sorted(costs, key=lambda name: -costs[name])
+    return [globals_order + ["channel"] + tellie_server.channel_settings,
+            ["channel"] + globals_order + tellie_server.channel_settings]
+
+
+def schedule(points, group_by=None, warm_up=None, cache=None):
+    """Order points to minimise the settings sent between them.
+
+    group_by: function of a point, points with the same key are run
+              together (e.g. by box), in order of the key.
+    warm_up: function of (previous point, point) returning a list of
+             points to run before point (e.g. to stabilise a channel),
+             these are marked with "warm_up": True.
+    cache: the starting settings cache (see SerialCommand.get_settings_cache).
+    Returns the candidate order with the least predicted reconfiguration
+    time (the original order is a candidate if there is no grouping).
+    """
+    candidates = []
+    if group_by is None:
+        candidates.append(list(points))
+    for order in setting_orders(points):
+        def sort_key(point):
+            group = group_by(point) if group_by else None
+            return [group] + [point.get(name) for name in order]
+        candidates.append(sorted(points, key=sort_key))
+    if warm_up:
+        candidates = [add_warm_up(candidate, warm_up) for candidate in candidates]
+    return min(candidates, key=lambda candidate: predict_time(candidate, cache)["reconfigure"])
+
+
+def add_warm_up(points, warm_up):
+    """Insert the warm up points requested by the warm_up function"""
+    with_warm_up = []
+    previous = None
+    for point in points:
+        for extra in warm_up(previous, point):
+            extra = dict(extra)
+            extra["warm_up"] = True
+            with_warm_up.append(extra)
+        with_warm_up.append(point)
+        previous = point
+    return with_warm_up
+
+
+def predict_time(points, cache=None):
+    """Predict the time (s) to run the points in order.  Returns a dict
+    of the reconfiguration, firing and total times.
+    """
+    if cache is None:
+        cache = {}
+    reconfigure = 0.
+    fire = 0.
+    for point in points:
+        settings = tellie_server.minimal_settings(cache, point_targets(point))
+        reconfigure += tellie_server.estimate_settings_time(settings)
+        fire += fire_time(point)
+        cache = apply_to_cache(cache, settings)
+    return {"reconfigure": reconfigure,
+            "fire": fire,
+            "total": reconfigure + fire}
+
+
+def run_campaign(tellie, points, callback=None):
+    """Run scheduled points, tellie is a SerialCommand or server proxy.
+
+    Returns a list of (point, pin, rms), skipping warm up points.  If
+    given, callback(point, pin, rms) is called as each point finishes.
+    """
+    prediction = predict_time(points, tellie.get_settings_cache())
+    print "Campaign of %d points, predicted time %.1f s (%.1f s reconfiguring, %.1f s firing)" % \
+        (len(points), prediction["total"], prediction["reconfigure"], prediction["fire"])
+    results = []
+    for point in points:
+        tellie.apply_settings(point_targets(point))
+        pin, rms, _ = tellie.fire_sequence_and_read()
+        if point.get("warm_up"):
+            continue
+        results.append((point, pin, rms))
+        if callback:
+            callback(point, pin, rms)
+    return results
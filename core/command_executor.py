@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+#
+# command_executor
+#
+# CommandExecutor
+#
+# Serialises calls to a SerialCommand instance for a
+# concurrent xmlrpc server: all hardware access runs
+# one call at a time on a single worker thread, while
+# read only calls are answered straight from memory.
+# A stop jumps the queue: the call in progress is
+# aborted (sending the stop byte at its next chunk
+# boundary), queued calls are cancelled and the clean
+# up runs next on the worker.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import Queue
+import sys
+import threading
+import time
+import SimpleXMLRPCServer as xmlrpc_server
+import event_publisher
+import metrics
+import tellie_exception
+from common import tellie_logger
+
+# Calls that only read cached state, safe to answer from any thread
+read_only_methods = ["get_pulse_delay",
+                     "get_pulse_number",
+                     "get_recovery_state",
+                     "get_settings_cache",
+                     "get_metrics",
+                     "get_startup_timing",
+                     "get_temperatures",
+                     "is_firing",
+                     "plan_settings",
+                     "sequence_duration"]
+
+# Calls that pre-empt the queue, with the method run first from the
+# request thread (passed the time the call arrived)
+priority_methods = {"stop": "stop_now"}
+
+
+class _Call(object):
+    """A queued call and, once run, its result or exception"""
+
+    def __init__(self, func, params):
+        self.func = func
+        self.params = params
+        self.result = None
+        self.exc_info = None
+        self.started = None
+        self.done = threading.Event()
+
+    def run(self):
+        self.started = time.time()
+        try:
+            self.result = self.func(*self.params)
+        except:
+            self.exc_info = sys.exc_info()
+        self.done.set()
+
+    def cancel(self, reason):
+        """Fail the call without running it"""
+        try:
+            raise tellie_exception.TellieException(reason)
+        except:
+            self.exc_info = sys.exc_info()
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+class CommandExecutor(threading.Thread):
+    """Run the instance's methods one at a time, in the order called.
+
+    Register this with the xmlrpc server in place of the instance.
+    """
+
+    def __init__(self, instance, read_only=read_only_methods, priority=priority_methods):
+        super(CommandExecutor, self).__init__(name="CommandExecutor")
+        self.daemon = True
+        self._instance = instance
+        self._read_only = set(read_only)
+        self._priority = dict(priority)
+        self._queue = Queue.Queue()
+        self.logger = tellie_logger.TellieLogger.get_instance()
+        self.start()
+
+    def run(self):
+        while True:
+            call = self._queue.get()
+            if call is None:
+                break
+            call.run()
+
+    def stop(self):
+        """Finish the queued calls, then stop the worker"""
+        self._queue.put(None)
+
+    def pending(self):
+        """Number of calls waiting for the serial port"""
+        return self._queue.qsize()
+
+    def submit(self, func, params=()):
+        """Queue a call, returns an object to wait() on for the result"""
+        call = _Call(func, params)
+        self._queue.put(call)
+        return call
+
+    def submit_priority(self, func, params=()):
+        """Cancel every queued call, then queue this one"""
+        call = _Call(func, params)
+        stop_worker = False
+        while True:
+            try:
+                queued = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if queued is None:
+                stop_worker = True
+            else:
+                queued.cancel("Cancelled by stop")
+        self._queue.put(call)
+        if stop_worker:
+            self._queue.put(None)
+        return call
+
+    def call(self, method, params=()):
+        """Run a method of the instance, queueing it unless it is read only.
+
+        Queued calls go through the instance's _dispatch, so each holds
+        the command lock (and is timed as rpc.<method>) for its whole
+        run; the time spent queued is recorded as queued.<method>.
+        """
+        arrived = time.time()
+        if method in self._read_only:
+            func = xmlrpc_server.resolve_dotted_attribute(self._instance, method, False)
+            return func(*params)
+        if method in self._priority:
+            getattr(self._instance, self._priority[method])(arrived)
+            call = self.submit_priority(self._instance._dispatch, (method, params))
+        else:
+            call = self.submit(self._instance._dispatch, (method, params))
+        try:
+            return call.wait()
+        except Exception, e:
+            if call.started is None:
+                # Cancelled, _dispatch publishes the errors of calls that ran
+                event_publisher.publish(event_publisher.ERROR, method=method, error=str(e))
+            raise
+        finally:
+            if call.started is not None:
+                metrics.Metrics.get_instance().record("queued." + method, call.started - arrived)
+
+    def _dispatch(self, method, params):
+        return self.call(method, params)
+
+    def _listMethods(self):
+        return xmlrpc_server.list_public_methods(self._instance)
+
+    def _methodHelp(self, method):
+        func = xmlrpc_server.resolve_dotted_attribute(self._instance, method, False)
+        return func.__doc__ or ""
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+#
+# event_publisher
+#
+# EventPublisher, Subscriber
+#
+# Streams tellie events (firing, end of sequence,
+# PIN/RMS readouts, stops, errors, temperatures and
+# power loss recovery states)
+# to any number of TCP subscribers as they happen,
+# so that clients do not need to poll the server.
+#
+# Each event is sent as one line of JSON:
+#   {"event": "pin", "time": 1760781234.5, "pin": 512.0, ...}
+# (a pin event's rms is null for a single PIN read).
+# Subscribers are not authenticated, so listen on the
+# control server's host (bin/tellie.py, localhost).
+# A slow subscriber has a bounded queue, the oldest
+# events are dropped once it is full.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import collections
+import json
+import socket
+import threading
+import time
+from common import parameters as p
+from common import tellie_logger
+
+# Event types
+FIRING = "firing"
+SEQUENCE_END = "sequence_end"
+PIN = "pin"
+STOP = "stop"
+ERROR = "error"
+TEMPERATURE = "temperature"
+RECOVERY = "recovery"
+
+
+class Subscriber(threading.Thread):
+    """Send queued events to one subscriber's socket"""
+
+    def __init__(self, sock, address, queue_size):
+        super(Subscriber, self).__init__(name="Subscriber %s:%s" % address)
+        self.daemon = True
+        self.address = address
+        self.dropped = 0
+        self._sock = sock
+        self._events = collections.deque(maxlen=queue_size)
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, line):
+        """Queue an event line, dropping the oldest if the queue is full"""
+        with self._condition:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(line)
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def closed(self):
+        return self._closed
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._events and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    break
+                lines = list(self._events)
+                self._events.clear()
+            try:
+                self._sock.sendall(''.join(lines))
+            except socket.error:
+                self._closed = True
+                break
+        self._sock.close()
+
+
+class EventPublisher(threading.Thread):
+    """Accept subscribers and publish events to them - there should only
+    ever be one publisher.
+    """
+
+    ## singleton instance
+    _instance = None
+
+    class SingletonHelper:
+
+        def __call__(self, *args, **kw):
+            if EventPublisher._instance is None:
+                object = EventPublisher()
+                EventPublisher._instance = object
+            return EventPublisher._instance
+
+    get_instance = SingletonHelper()
+
+    def __init__(self, queue_size=p._event_queue_size):
+        if EventPublisher._instance:
+            raise Exception("Only one event publisher allowed!")
+        super(EventPublisher, self).__init__(name="EventPublisher")
+        EventPublisher._instance = self
+        self.daemon = True
+        self._queue_size = queue_size
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._sock = None
+        self.logger = tellie_logger.TellieLogger.get_instance()
+
+    def listen(self, host="localhost", port=p._event_port):
+        """Start accepting subscribers on host:port.  Events carry firing
+        and PIN data and subscribers are not authenticated, so listen on
+        the same host as the control server.
+        """
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(16)
+        self.start()
+
+    def run(self):
+        while True:
+            try:
+                sock, address = self._sock.accept()
+            except socket.error:
+                break
+            self.logger.debug("Event subscriber connected from %s:%s" % address)
+            subscriber = Subscriber(sock, address, self._queue_size)
+            subscriber.start()
+            with self._lock:
+                self._subscribers.append(subscriber)
+
+    def publish(self, event, **data):
+        """Send an event to all subscribers, never blocks"""
+        if not self._subscribers:
+            return
+        data["event"] = event
+        data["time"] = time.time()
+        line = json.dumps(data) + '\n'
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if not s.closed()]
+            for subscriber in self._subscribers:
+                subscriber.put(line)
+
+    def get_subscribers(self):
+        """Get the address and number of dropped events of each subscriber"""
+        with self._lock:
+            return [{"client": "%s:%s" % s.address, "dropped": s.dropped}
+                    for s in self._subscribers if not s.closed()]
+
+
+def publish(event, **data):
+    """Publish an event with the EventPublisher"""
+    EventPublisher.get_instance().publish(event, **data)
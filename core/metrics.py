@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+#
+# metrics
+#
+# Metrics, Latency, MetricsDumper
+#
+# Latency distributions and counters for the tellie
+# server (per xmlrpc method and serial command, bytes
+# read and written, echo retries, buffer mismatches,
+# time spent sleeping), so that the pauses and retries
+# in tellie.cfg can be tuned from measurements.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import collections
+import contextlib
+import json
+import threading
+import time
+from common import parameters as p
+
+
+class Latency(object):
+    """Latencies of one operation: totals over all calls, percentiles
+    over the most recent calls.
+    """
+
+    def __init__(self, samples):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self._samples = collections.deque(maxlen=samples)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+    def summary(self):
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99),
+                "max": self.max}
+
+
+class Metrics:
+    """Latencies and counters - there should only ever be one set.
+    """
+
+    ## singleton instance
+    _instance = None
+
+    class SingletonHelper:
+
+        def __call__(self, *args, **kw):
+            if Metrics._instance is None:
+                object = Metrics()
+                Metrics._instance = object
+            return Metrics._instance
+
+    get_instance = SingletonHelper()
+
+    def __init__(self, samples=p._metrics_samples):
+        if Metrics._instance:
+            raise Exception("Only one set of metrics allowed!")
+        Metrics._instance = self
+        self._samples = samples
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._start = time.time()
+            self._latencies = {}
+            self._counters = collections.defaultdict(float)
+
+    def record(self, name, seconds):
+        """Record the latency of one call of name"""
+        with self._lock:
+            if name not in self._latencies:
+                self._latencies[name] = Latency(self._samples)
+            self._latencies[name].add(seconds)
+
+    def count(self, name, n=1):
+        """Add n to a counter"""
+        with self._lock:
+            self._counters[name] += n
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Record the latency of the enclosed block"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    def get_metrics(self):
+        """Get the latency summaries and counters since the last reset"""
+        with self._lock:
+            latencies = dict((name, latency.summary())
+                             for name, latency in self._latencies.iteritems())
+            return {"start": self._start,
+                    "time": time.time(),
+                    "latency": latencies,
+                    "counters": dict(self._counters)}
+
+
+class MetricsDumper(threading.Thread):
+    """Append the metrics to a file, one JSON line every interval seconds"""
+
+    def __init__(self, file_name=p._metrics_file, interval=p._metrics_interval):
+        super(MetricsDumper, self).__init__(name="MetricsDumper")
+        self.daemon = True
+        self._file_name = file_name
+        self._interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            with open(self._file_name, 'a') as f:
+                f.write(json.dumps(Metrics.get_instance().get_metrics()) + '\n')
@@ -2,30 +2,170 @@
 #
 # orca_comms
 #
-# TellieServer, TellieEcho
+# TellieServer, TellieEcho, SerialExecutor
 #
 # TellieServer & TellieEcho: classes to handle
 # requests from Orca and provide responses.
 # Module also contains functions to parse and handle
 # the communications from Orca.
 #
+# Requests and responses are each terminated by a
+# newline, several requests may be sent on one
+# connection without waiting for the responses,
+# which are returned in the order of the requests.
+#
+# Requests are run on a SerialExecutor thread, fed by
+# a bounded queue, so the asyncore loop only does the
+# socket I/O.  PIN reads do not block: they stay
+# pending until the readout arrives (or times out)
+# while other requests are run, see serve().  A stop
+# aborts the request in progress at once, cancelling
+# the queued requests.
+# A stats request is answered straight away with the
+# request counts of each connection.  The flags and the
+# format of each request and response are set out in
+# common/comms_flags.py.
+#
 # Author: Matt Mottram
 #         <m.mottram@sussex.ac.uk>
 #
 # History:
 # 2013/03/13: First instance
+# 2026/10/18: Newline framing, pipelined requests
+# 2026/10/18: Deferred PIN reads
+# 2026/10/18: Serial executor with bounded queue
+# 2026/10/18: Priority stop
+# 2026/10/18: Stats request
 #
 ###########################################
 ###########################################
 
 import asyncore
+import collections
+import Queue
 import socket
 import os
 import json
+import threading
+import time
 from common import comms_flags, tellie_logger
+from common import parameters as p
 import tellie_server
 import tellie_exception
 
+# Pending connections allowed before Orca/DAQ clients are refused
+_listen_backlog = 16
+# Longest request accepted (init JSON for every LED is well within this)
+_max_request_size = 1 << 20
+# Connections with finished requests to send, filled by the executor
+_completed = collections.deque()
+
+# Request states
+QUEUED = "queued"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+
+
+class Job(object):
+    """A request from a connection and, once run, its response"""
+
+    def __init__(self, echo, request):
+        self.echo = echo
+        self.request = request
+        self.state = QUEUED
+        self.response = None
+        self.priority = False
+        self.arrived = time.time()
+        # Reads are retried until this time
+        self.deadline = time.time() + p._orca_read_timeout
+
+    def finish(self, response):
+        self.response = response
+        self.state = DONE
+        _completed.append(self.echo)
+
+
+class SerialExecutor(threading.Thread):
+    """Run requests one at a time on the serial port.
+
+    The queue is bounded: once full, new requests are refused straight
+    away rather than buffered.  Reads that are not ready yet are kept
+    aside and retried between other requests.
+    """
+
+    def __init__(self, tellie_serial, queue_size=p._orca_queue_size):
+        super(SerialExecutor, self).__init__(name="SerialExecutor")
+        self.daemon = True
+        self._tellie_serial = tellie_serial
+        self._queue = Queue.Queue(maxsize=queue_size)
+        self._pending_reads = []
+        self.logger = tellie_logger.TellieLogger.get_instance()
+
+    def submit(self, job):
+        """Queue a job, raises Queue.Full if the queue is full"""
+        self._queue.put_nowait(job)
+
+    def submit_stop(self, job):
+        """Abort the job in progress, cancel the queued jobs and queue the stop's
+        clean up (job) to run next.
+        """
+        self._tellie_serial.stop_now(job.arrived)
+        job.priority = True
+        while True:
+            try:
+                queued = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if queued is None:
+                # Stopping, the clean up will not be run
+                self._queue.put(None)
+                job.finish(comms_flags.tellie_error + "|" + "Server stopping!")
+                return
+            queued.finish(comms_flags.tellie_error + "|" + "Cancelled by stop")
+        self._queue.put_nowait(job)
+
+    def stop(self):
+        self._queue.put(None)
+
+    def run(self):
+        while True:
+            try:
+                # Wake up to retry the pending reads
+                job = self._queue.get(timeout=p._orca_poll if self._pending_reads else None)
+            except Queue.Empty:
+                job = False
+            if job is None:
+                break
+            if job:
+                if job.priority:
+                    # No readout will come after a stop
+                    for read in self._pending_reads:
+                        read.finish(comms_flags.tellie_error + "|" + "Cancelled by stop")
+                    self._pending_reads = []
+                self._execute(job)
+            pending, self._pending_reads = self._pending_reads, []
+            for job in pending:
+                self._execute(job)
+
+    def _execute(self, job):
+        job.state = IN_FLIGHT
+        try:
+            # As an xmlrpc call: nothing else uses the port meanwhile
+            with self._tellie_serial._lock:
+                response = handle_request(job.request, self._tellie_serial)
+        except (tellie_exception.TellieException, tellie_server.TellieException), e:
+            response = comms_flags.tellie_error + "|" + str(e)
+        except Exception, e:
+            self.logger.warn("Error handling request %s: %s" % (job.request[:50], e))
+            response = comms_flags.tellie_error + "|" + str(e)
+        if response is None:
+            # Sequence not finished yet
+            if time.time() < job.deadline:
+                self._pending_reads.append(job)
+                return
+            response = comms_flags.tellie_notready
+        job.finish(response)
+
 
 class TellieServer(asyncore.dispatcher):
     """Server class for asynchronous I/O to Tellie"""
@@ -35,46 +175,131 @@ class TellieServer(asyncore.dispatcher):
         asyncore.dispatcher.__init__(self)
         self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
         self.bind((host, port))
-        self.listen(1)
-        self._tellie_serial = tellie_serial
+        self.listen(_listen_backlog)
+        self._executor = SerialExecutor(tellie_serial)
+        self._executor.start()
+        self._connections = set()
         self.logger = tellie_logger.TellieLogger.get_instance()
 
     def handle_accept(self):
         """Handle connection requests"""
         self.logger.debug("handle accept")
         sock, address = self.accept()
-        TellieEcho(sock, address, self._tellie_serial)
+        self._connections.add(TellieEcho(sock, address, self._executor, self._connections))
+
+    def get_stats(self):
+        """Get the request counts of each open connection, keyed by client"""
+        return connection_stats(self._connections)
+
+    def close(self):
+        self._executor.stop()
+        asyncore.dispatcher.close(self)
 
 
 class TellieEcho(asyncore.dispatcher_with_send):
     """Echo handling class for Tellie responses"""
 
- def __init__(self, conn_sock, client_address, tellie_serial):
+    def __init__(self, conn_sock, client_address, executor, connections):
         """Initialisation function"""
         asyncore.dispatcher_with_send.__init__(self, conn_sock)
         self.client_address = client_address
-        self._tellie_serial = tellie_serial
+        self._executor = executor
+        self._connections = connections
+        self._in_buffer = ''
+        self._jobs = collections.deque() # in request order
+        self._completed = 0
+        self._closing = False
         self.logger = tellie_logger.TellieLogger.get_instance()
 
+    def readable(self):
+        # Backpressure: stop reading while this client has too many requests outstanding
+        return len(self._jobs) < p._orca_max_in_flight
+
     def handle_read(self):
         """Handle communication from Orca, echo accordingly"""
-        self.logger.debug("handle read")
-        self.out_buffer = self.recv(1024)
-        self.logger.debug("read: %s"%(self.out_buffer))
+        data = self.recv(4096)
+        if not data:
+            self.close()
+            return
+        self._in_buffer += data
+        self._submit_requests()
+        self.send_responses()
+        if len(self._in_buffer) > _max_request_size and '\n' not in self._in_buffer:
+            self.logger.warn("Request from %s too long, closing" % (self.client_address,))
+            self.send(comms_flags.tellie_error + "|" + "Request too long!\n")
+            self._in_buffer = ''
+            self.close_when_done()
+
+    def _submit_requests(self):
+        """Queue complete requests, up to the limit outstanding per client"""
+        while '\n' in self._in_buffer and self.readable():
+            request, self._in_buffer = self._in_buffer.split('\n', 1)
+            request = request.rstrip('\r')
+            if request:
+                self._submit(request)
+
+    def _submit(self, request):
+        if self.logger.debug_enabled():
+            self.logger.debug("read: %s" % (request))
+        job = Job(self, request)
+        if request == comms_flags.orca_stats:
+            stats = connection_stats(self._connections)
+            self._jobs.append(job)
+            job.finish(comms_flags.tellie_stats + "|" + json.dumps(stats))
+            return
+        self._jobs.append(job)
+        try:
+            if '|' not in request and request[0] == comms_flags.orca_stop:
+                self._executor.submit_stop(job)
+            else:
+                self._executor.submit(job)
+        except Queue.Full:
+            job.finish(comms_flags.tellie_error + "|" + "Command queue full!")
+
+    def send_responses(self):
+        """Send the responses that are ready, in request order"""
+        while self._jobs and self._jobs[0].state == DONE:
+            job = self._jobs.popleft()
+            self.send(job.response + '\n')
+            if job.request != comms_flags.orca_stats:
+                self._completed += 1
+        # Requests held back by the limit can now be queued
+        self._submit_requests()
+
+    def get_stats(self):
+        """Get the number of this client's requests queued, in flight
+        and completed, not counting stats requests
+        """
+        states = [job.state for job in self._jobs if job.request != comms_flags.orca_stats]
+        return {QUEUED: states.count(QUEUED),
+                IN_FLIGHT: states.count(IN_FLIGHT),
+                "completed": self._completed + states.count(DONE)}
+
+    def close(self):
+        self._connections.discard(self)
+        asyncore.dispatcher_with_send.close(self)
+
+    def close_when_done(self):
+        """Close once everything queued has been sent"""
+        self._closing = True
         if not self.out_buffer:
             self.close()
-        else:
-            try:
-                response = handle_request(self.out_buffer, self._tellie_serial)
-                self.out_buffer = response
-            except tellie_exception.TellieException, e:
-                self.out_buffer = comms_flags.tellie_error+"|"+str(e)
+
+    def handle_write(self):
+        asyncore.dispatcher_with_send.handle_write(self)
+        if self._closing and not self.out_buffer:
+            self.close()
+
+
+def connection_stats(connections):
+    """Get the request counts of each connection, keyed by host:port"""
+    return dict(("%s:%s" % echo.client_address, echo.get_stats()) for echo in connections)
 
 
 def handle_request(request, tellie_serial):
     """Handle the command from Orca"""
     response = None
-    if len(request.split('|')) != 2:
+    if '|' not in request:
         if request[0] == comms_flags.orca_stop:
             response = tellie_stop(tellie_serial)
         elif request[0] == comms_flags.orca_read:
@@ -82,10 +307,8 @@ def handle_request(request, tellie_serial):
         else:
             response = comms_flags.tellie_error + "|" + "Unknown input!"
     else:
-        bits = request.split('|')
-        flagin = bits[0]
-        settings = bits[1]
-        #flagin, settings = request.split('|')[0]
+        # JSON settings may themselves contain '|'
+        flagin, settings = request.split('|', 1)
         if flagin == comms_flags.orca_init:
             response = tellie_init(tellie_serial, settings)
         elif flagin == comms_flags.orca_fire:
@@ -114,10 +337,10 @@ def tellie_init(tellie_serial, json_settings):
     settings = json.loads(json_settings)
     print "LOAD", settings
     for led in settings:
-        tellie_serial.select_channel(led)
-        tellie_serial.set_pulse_height(settings[led]["pulse_height"])
-        tellie_serial.set_pulse_width(settings[led]["pulse_width"])
-        tellie_serial.set_fibre_delay(settings[led]["fibre_delay"])
+        tellie_serial.set_settings([("channel", led),
+                                    ("pulse_height", settings[led]["pulse_height"]),
+                                    ("pulse_width", settings[led]["pulse_width"]),
+                                    ("fibre_delay", settings[led]["fibre_delay"])])
     return comms_flags.tellie_ready
 
 
@@ -126,9 +349,9 @@ def tellie_fire(tellie_serial, json_settings):
     settings = json.loads(json_settings)
     print "FIRE", settings
     n_led = len(settings["channels"])
-    tellie_serial.set_pulse_number(settings["pulse_number"])
-    tellie_serial.set_pulse_delay(settings["pulse_delay"])
-    tellie_serial.set_trigger_delay(settings["trigger_delay"])
+    tellie_serial.set_settings([("pulse_number", settings["pulse_number"]),
+                                ("pulse_delay", settings["pulse_delay"]),
+                                ("trigger_delay", settings["trigger_delay"])])
     if n_led == 1:
         tellie_serial.select_channel(settings["channels"][0])
         tellie_serial.fire_sequence()
@@ -142,20 +365,38 @@ def tellie_fire(tellie_serial, json_settings):
 
 
 def tellie_read(tellie_serial):
-    """Read a the PINout from the fired channels"""
+    """Check for the PINout from the fired channels, without waiting.
+    Returns None if the sequence has not finished yet.
+    """
     try:
-        pin_out = None
-        while (pin_out==None):
-            try:
-                pin_out, rms, channel_list = tellie_serial.read_pin_sequence()
-            except TypeError:
-                pin_out = None
-        if comms_flags.valid_pin(pin_out, channel_list):
-            print pin_out
-            return '%s|%s' % (comms_flags.tellie_pinout, json.dumps(pin_out))
-        else:
-           return comms_flags.tellie_notready
-    except tellie_exception.TellieException, e:
-        pin_out = ''
+        result = tellie_serial.read_pin_sequence(timeout=0)
+    except (tellie_exception.TellieException, tellie_server.TellieException), e:
         print e, type(e)
-        return comms_flags.tellie_error, "NOT YET..."
+        return comms_flags.tellie_error + "|" + str(e)
+    if result is None:
+        return None
+    pin_out, rms, channel_list = result
+    if comms_flags.valid_pin(pin_out, channel_list):
+        print pin_out
+        return '%s|%s' % (comms_flags.tellie_pinout, json.dumps(pin_out))
+    else:
+        return comms_flags.tellie_notready
+
+
+def send_completed():
+    """Send the responses of requests the executor has finished"""
+    while _completed:
+        echo = _completed.popleft()
+        if echo.connected:
+            echo.send_responses()
+
+
+def serve(host, port, tellie_serial, poll=p._orca_poll):
+    """Run the Orca server, sending finished responses every poll seconds"""
+    server = TellieServer(host, port, tellie_serial)
+    try:
+        while asyncore.socket_map:
+            asyncore.loop(timeout=poll, count=1)
+            send_completed()
+    finally:
+        server.close()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# power_recovery
+#
+# PowerRecovery
+#
+# Brings the control box back after a power loss (seen
+# as a '\x00' in place of an echo): re-handshake, drop
+# the settings cache, replay the last known good
+# settings in one batch, then resume the interrupted
+# command.  Each attempt is retried with an increasing
+# back-off, the recovery fails cleanly once the retries
+# are used up.
+#
+#   DETECTED -> HANDSHAKE -> REPLAY -> RESUMED
+#                   ^           |
+#                   +-----------+ (retry)  -> FAILED
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import collections
+import time
+import event_publisher
+from common import parameters as p
+
+# Recovery states
+DETECTED = "detected"
+HANDSHAKE = "handshake"
+REPLAY = "replay"
+RESUMED = "resumed"
+FAILED = "failed"
+
+# State changes kept for get_state
+_history_size = 100
+
+
+class PowerRecovery(object):
+    """Recovery state machine for one SerialCommand"""
+
+    def __init__(self, tellie_serial, retries=p._recovery_retries, backoff=p._recovery_backoff):
+        self._tellie_serial = tellie_serial
+        self._retries = retries
+        self._backoff = backoff
+        self.state = None
+        self.recoveries = 0
+        self.failures = 0
+        self._history = collections.deque(maxlen=_history_size)
+
+    def _enter(self, state, detail=""):
+        self.state = state
+        self._history.append((time.time(), state, detail))
+        self._tellie_serial.log_phrase("Power loss recovery: %s %s", 1, args=(state, detail))
+        event_publisher.publish(event_publisher.RECOVERY, state=state, detail=detail)
+
+    def recover(self, resume):
+        """Run the recovery, calling resume() to re-run the interrupted
+        command once the settings are restored.  Returns True if the
+        command was resumed, False once every retry has failed.
+        """
+        tellie = self._tellie_serial
+        self._enter(DETECTED)
+        # The cache is what the box last confirmed
+        settings, channels = tellie.known_good_settings()
+        delay = self._backoff
+        for attempt in range(1, self._retries + 1):
+            tellie.invalidate_settings()
+            self._enter(HANDSHAKE, "attempt %d" % attempt)
+            try:
+                if tellie.handshake():
+                    self._enter(REPLAY, "%d settings" % len(settings))
+                    tellie.replay_settings(settings, channels)
+                    resume()
+                    self.recoveries += 1
+                    self._enter(RESUMED)
+                    return True
+                detail = "no handshake"
+            except Exception, e:
+                detail = str(e)
+            tellie.log_phrase("Recovery attempt %d failed: %s", 2, args=(attempt, detail))
+            tellie._sleep(delay)
+            delay *= 2
+        tellie.invalidate_settings()
+        self.failures += 1
+        self._enter(FAILED)
+        return False
+
+    def get_state(self):
+        """Get the current state, counts and recent state changes"""
+        return {"state": self.state,
+                "recoveries": self.recoveries,
+                "failures": self.failures,
+                "history": list(self._history)}
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#
+# rpc_server
+#
+# ThreadedXMLRPCServer, KeepAliveRequestHandler
+#
+# xmlrpc servers for the tellie control box: the
+# original single threaded server, or one handling
+# each client on its own thread with the hardware
+# calls serialised through a CommandExecutor.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import SocketServer
+from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+import command_executor
+
+
+class KeepAliveRequestHandler(SimpleXMLRPCRequestHandler):
+    """Keep HTTP/1.1 connections open between requests.  Only for the
+    threaded server, a single threaded server would be stuck on one client.
+    """
+    protocol_version = "HTTP/1.1"
+    # Close connections left idle for this long (s)
+    timeout = 60
+
+
+class ThreadedXMLRPCServer(SocketServer.ThreadingMixIn, SimpleXMLRPCServer):
+    """xmlrpc server handling each request on a new thread"""
+    daemon_threads = True
+    # Many clients may connect at once (GUI, Orca scripts, monitoring)
+    request_queue_size = 32
+
+
+def make_server(tellie_control, host, port, concurrent=False):
+    """Get an xmlrpc server for tellie_control (a SerialCommand).
+
+    If concurrent, clients are served in parallel over persistent
+    connections: read only calls are answered immediately and everything
+    else queues for the serial port.
+    Returns (server, executor), executor is None if not concurrent.
+    """
+    if not concurrent:
+        server = SimpleXMLRPCServer((host, port), allow_none=True)
+        server.register_instance(tellie_control)
+        return server, None
+    executor = command_executor.CommandExecutor(tellie_control)
+    server = ThreadedXMLRPCServer((host, port), requestHandler=KeepAliveRequestHandler,
+                                  allow_none=True)
+    server.register_instance(executor)
+    return server, executor
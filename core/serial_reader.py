@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# serial_reader
+#
+# SerialParser, SerialReader
+#
+# Thread that continuously drains the tellie serial
+# port, splitting the stream into typed events (echoes,
+# PIN/RMS readouts, end of sequence markers and
+# temperatures) that callers can wait on.
+#
+# SerialParser holds the parsing and waiting, so that
+# the port can also be read without a thread (see
+# transaction_engine.py).
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import collections
+import threading
+import metrics
+from common import parameters as p
+from common import clock as tellie_clock
+
+# Event types
+PIN = "pin"                     # PIN readout, value is (pin, rms or None)
+TEMP = "temp"                   # temperature readout, value is a float
+END_SEQUENCE = "end_sequence"   # 'K' sent at the end of a fire sequence
+RAW = "raw"                     # anything else (e.g. echoes nobody waited for)
+
+SerialEvent = collections.namedtuple("SerialEvent", ["kind", "value", "raw", "timestamp"])
+
+_numeric_chars = "0123456789.+-"
+
+
+class SerialParser(object):
+    """Parse the bytes read from the serial port into a bounded ring
+    buffer of events.
+
+    Echoes are only recognised when the sender has said how many
+    chars to expect (expect_echo), everything else is tokenised.
+    Timeouts and event times go by clock (see common/clock.py).
+    """
+
+    def __init__(self, serial_port, ring_size=p._reader_ring_size, clock=None):
+        self._serial = serial_port
+        self._clock = clock or tellie_clock.real_clock
+        self._events = collections.deque(maxlen=ring_size)
+        self._condition = threading.Condition()
+        self._echo = ''
+        self._echo_expected = 0
+        self._record = '' # numeric readout currently being received
+        self._expect_temp = False
+        self._metrics = metrics.Metrics.get_instance()
+
+    def _feed(self, data):
+        """Handle the data from one read of the port"""
+        if data:
+            self._metrics.count("bytes_read", len(data))
+        with self._condition:
+            if data:
+                self._tokenise(data)
+            elif self._record:
+                # Readouts without a line ending are complete once the line goes quiet
+                self._end_record()
+            self._condition.notify_all()
+
+    def _poll(self):
+        """Handle anything already read, before a wait checks for it"""
+        pass
+
+    def _wait(self, timeout):
+        """Wait up to timeout for more data (condition held)"""
+        self._condition.wait(timeout)
+
+    def _tokenise(self, data):
+        for c in data:
+            if self._echo_expected > 0:
+                self._echo += c
+                self._echo_expected -= 1
+            elif c == p._buffer_end_sequence:
+                self._end_record()
+                self._push(END_SEQUENCE, None, c)
+            elif c in _numeric_chars or (c in " \t" and self._record):
+                self._record += c
+            elif c in " \t\r\n":
+                self._end_record()
+            else:
+                self._end_record()
+                self._push(RAW, c, c)
+
+    def _end_record(self):
+        raw = self._record
+        self._record = ''
+        if not raw.strip():
+            return
+        try:
+            values = [float(n) for n in raw.split()]
+        except ValueError:
+            self._push(RAW, raw, raw)
+            return
+        if self._expect_temp and len(values) == 1:
+            self._expect_temp = False
+            self._push(TEMP, values[0], raw)
+        elif len(values) == 2:
+            self._push(PIN, (values[0], values[1]), raw)
+        elif len(values) == 1:
+            self._push(PIN, (values[0], None), raw)
+        else:
+            self._push(RAW, raw, raw)
+
+    def _push(self, kind, value, raw):
+        self._events.append(SerialEvent(kind, value, raw, self._clock.time()))
+
+    def _pop(self, kind):
+        for event in self._events:
+            if event.kind == kind:
+                self._events.remove(event)
+                return event
+        return None
+
+    def expect_echo(self, n):
+        """The next n chars read are the echo of a command"""
+        with self._condition:
+            self._echo = ''
+            self._echo_expected = n
+
+    def clear_echo(self):
+        """Stop expecting an echo, later chars are tokenised as normal"""
+        with self._condition:
+            self._echo = ''
+            self._echo_expected = 0
+
+    def expect_temp(self):
+        """The next single number readout is a temperature"""
+        with self._condition:
+            self._expect_temp = True
+
+    def read_echo(self, n, timeout):
+        """Return up to n echoed chars, as soon as they have arrived"""
+        end = self._clock.time() + timeout
+        with self._condition:
+            self._poll()
+            while len(self._echo) < n:
+                remaining = end - self._clock.time()
+                if remaining <= 0:
+                    break
+                self._wait(remaining)
+            echo = self._echo[:n]
+            self._echo = self._echo[n:]
+        return echo
+
+    def wait_for(self, kind, timeout, abort=None):
+        """Remove and return the oldest event of this kind, waiting up
+        to timeout seconds for one to arrive.  Returns None on timeout,
+        or as soon as abort() is true (checked every echo_poll).
+        """
+        end = self._clock.time() + timeout
+        with self._condition:
+            self._poll()
+            while True:
+                event = self._pop(kind)
+                if event is not None:
+                    return event
+                remaining = end - self._clock.time()
+                if remaining <= 0 or (abort and abort()):
+                    return None
+                self._wait(min(remaining, p._echo_poll) if abort else remaining)
+
+    def drain(self):
+        """Remove and return the raw text of everything not yet claimed,
+        no longer expecting a temperature
+        """
+        with self._condition:
+            self._poll()
+            raw = ''.join(event.raw for event in self._events) + self._record + self._echo
+            self._events.clear()
+            self._record = ''
+            self._echo = ''
+            self._expect_temp = False
+        return raw
+
+
+class SerialReader(SerialParser, threading.Thread):
+    """Drain the serial port into the parser on a background thread.
+    Its waits are real, so it needs the real clock.
+    """
+
+    def __init__(self, serial_port, ring_size=p._reader_ring_size):
+        SerialParser.__init__(self, serial_port, ring_size)
+        threading.Thread.__init__(self, name="SerialReader")
+        self.daemon = True
+        self._stop_flag = False
+
+    def stop(self):
+        self._stop_flag = True
+
+    def run(self):
+        while not self._stop_flag:
+            try:
+                # Blocks for at most the port timeout
+                data = self._serial.read(self._serial.inWaiting() or 1)
+            except Exception:
+                # Port closed or lost, nothing more to read
+                break
+            self._feed(data)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+#
+# serial_recorder
+#
+# RecordingPort, ReplayPort
+#
+# Record all traffic on the tellie serial port (writes,
+# reads, buffer sizes and RTS changes, with timestamps)
+# to a compact binary log, and replay such a log through
+# a fake port, so that e.g. a power loss or a buffer
+# mismatch seen in the field can be reproduced offline:
+#
+#   port = serial_recorder.ReplayPort("incident.rec")
+#   sc = tellie_server.SerialCommand(port=port, use_reader=False)
+#
+# Log format: a header line, then records of
+#   <time since start (double)><kind (char)><length (uint32)><data>
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import struct
+import sys
+import threading
+import time
+
+_header = "TELLIE SERIAL LOG 1\n"
+_record = struct.Struct("<dcI")
+
+# Record kinds
+WRITE = "W"
+READ = "R"
+WAITING = "I"   # inWaiting, data is the count as a uint32
+RTS = "T"       # setRTS, data is '\x01' or '\x00'
+
+
+class RecordingPort(object):
+    """Wrap a serial port, logging everything that passes through it"""
+
+    def __init__(self, port, log_file):
+        self._port = port
+        self._log = open(log_file, 'wb')
+        self._log.write(_header)
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def _write_record(self, kind, data):
+        with self._lock:
+            self._log.write(_record.pack(time.time() - self._start, kind, len(data)) + data)
+
+    def write(self, data):
+        self._write_record(WRITE, data)
+        return self._port.write(data)
+
+    def read(self, n=1):
+        data = self._port.read(n)
+        self._write_record(READ, data)
+        return data
+
+    def inWaiting(self):
+        waiting = self._port.inWaiting()
+        self._write_record(WAITING, struct.pack("<I", waiting))
+        return waiting
+
+    def setRTS(self, level=True):
+        self._write_record(RTS, '\x01' if level else '\x00')
+        return self._port.setRTS(level)
+
+    def reopen(self, port):
+        """Close the wrapped port and carry on logging with port"""
+        try:
+            self._port.close()
+        except Exception:
+            pass
+        self._port = port
+
+    def close(self):
+        with self._lock:
+            self._log.close()
+        self._port.close()
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+
+def load(log_file):
+    """Get the (time, kind, data) records of a log"""
+    with open(log_file, 'rb') as f:
+        if f.readline() != _header:
+            raise ValueError("%s is not a tellie serial log" % (log_file))
+        records = []
+        while True:
+            head = f.read(_record.size)
+            if len(head) < _record.size:
+                break
+            timestamp, kind, length = _record.unpack(head)
+            records.append((timestamp, kind, f.read(length)))
+    return records
+
+
+class ReplayPort(object):
+    """A fake serial port returning the reads of a recorded log.
+
+    Each read returns the next recorded (non empty) read, once every
+    write recorded before it has been made, so replies never overtake
+    the commands that caused them.  Writes that differ from the recording
+    are kept in mismatches.  With realtime, reads also wait until the
+    time they were recorded at.
+    """
+
+    def __init__(self, log_file, timeout=None, realtime=False):
+        self.timeout = timeout
+        self.port = log_file
+        self.mismatches = []
+        self._realtime = realtime
+        self._condition = threading.Condition()
+        self._writes = []   # recorded writes
+        self._reads = []    # (time, writes before, data)
+        for timestamp, kind, data in load(log_file):
+            if kind == WRITE:
+                self._writes.append(data)
+            elif kind == READ and data:
+                self._reads.append((timestamp, len(self._writes), data))
+        self._n_written = 0
+        self._start = time.time()
+
+    def write(self, data):
+        with self._condition:
+            if self._n_written >= len(self._writes):
+                self.mismatches.append((self._n_written, None, data))
+            elif self._writes[self._n_written] != data:
+                self.mismatches.append((self._n_written, self._writes[self._n_written], data))
+            self._n_written += 1
+            self._condition.notify_all()
+        return len(data)
+
+    def read(self, n=1):
+        with self._condition:
+            if not self._reads:
+                return ''
+            timestamp, writes_before, data = self._reads[0]
+            end = None if self.timeout is None else time.time() + self.timeout
+            while self._n_written < writes_before:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return ''
+                self._condition.wait(remaining)
+            self._reads.pop(0)
+            if len(data) > n:
+                # Keep the rest for the next read
+                self._reads.insert(0, (timestamp, writes_before, data[n:]))
+                data = data[:n]
+        if self._realtime:
+            time.sleep(max(self._start + timestamp - time.time(), 0))
+        return data
+
+    def inWaiting(self):
+        """The size of the next read, once it is due"""
+        with self._condition:
+            if self._reads and self._reads[0][1] <= self._n_written:
+                return len(self._reads[0][2])
+            return 0
+
+    def setRTS(self, level=True):
+        pass
+
+    def close(self):
+        with self._condition:
+            self._reads = []
+            self._condition.notify_all()
+
+    def finished(self):
+        """Check all recorded reads and writes have been replayed"""
+        return not self._reads and self._n_written >= len(self._writes)
+
+
+if __name__ == "__main__":
+    for timestamp, kind, data in load(sys.argv[1]):
+        if kind == WAITING:
+            data = str(struct.unpack("<I", data)[0])
+        print "%10.6f %s %r" % (timestamp, kind, data)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+#
+# serial_transport
+#
+# open_transport
+#
+# Open the link to the tellie control box from a port
+# name or URL, all giving the same write/read/inWaiting/
+# setRTS interface:
+#   COM20, /dev/ttyUSB0           local usb-serial port
+#   socket://host:port            raw TCP (e.g. ser2net)
+#   rfc2217://host:port           RFC 2217 serial over telnet
+#   loop://                       pyserial loopback (writes read back)
+#   emulator://?seed=1&...        in-process SNO6C emulator
+#
+# The emulator URL takes the SNO6CEmulator options as
+# query parameters: echo_latency, time_scale, seed,
+# drop_echo, corrupt_echo and power_loss.  It runs on
+# the given clock, so can go in virtual time.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import urlparse
+import serial
+from common import parameters as p
+from common import clock as tellie_clock
+
+EMULATOR_SCHEME = "emulator"
+
+
+def open_transport(url, timeout=p._port_timeout, clock=None):
+    """Open a port from a device name or URL, raises serial.SerialException
+    (or ValueError for a bad URL) if it cannot be opened.
+    """
+    if url.startswith(EMULATOR_SCHEME + "://"):
+        return open_emulator(url, timeout, clock)
+    return serial.serial_for_url(url, timeout=timeout)
+
+
+def open_emulator(url, timeout=p._port_timeout, clock=None):
+    """Start an in-process emulator from an emulator:// URL"""
+    # Not imported above: the emulator needs the unix only tty module
+    import sno6c_emulator
+    clock = clock or tellie_clock.real_clock
+    query = urlparse.parse_qs(urlparse.urlsplit(url).query)
+    def option(name, cast, default):
+        return cast(query[name][0]) if name in query else default
+    faults = {sno6c_emulator.DROP_ECHO: option("drop_echo", float, 0.),
+              sno6c_emulator.CORRUPT_ECHO: option("corrupt_echo", float, 0.),
+              sno6c_emulator.POWER_LOSS: option("power_loss", float, 0.)}
+    emulator = sno6c_emulator.SNO6CEmulator(option("echo_latency", float, p._echo_latency), faults,
+                                            option("seed", int, None),
+                                            clock=clock.time, time_scale=option("time_scale", float, 1.))
+    port = sno6c_emulator.EmulatorPort(emulator, timeout, clock)
+    port.port = url
+    return port
@@ -0,0 +1,374 @@
+#!/usr/bin/env python
+#
+# sno6c_emulator
+#
+# SNO6CEmulator, EmulatorPort, PtyEmulator, SocketEmulator
+#
+# Emulates the PIC command set of the SNO6C tellie
+# control box (see tellie.cfg [COMMANDS]): channel
+# selection, settings with their echoes, sequence and
+# series firing with PIN/RMS readouts after the
+# simulated pulse train, and temperature probes.
+#
+# PtyEmulator serves the emulator on a pseudo-terminal,
+# so an unmodified SerialCommand can connect to it:
+#
+#   emulator = sno6c_emulator.PtyEmulator()
+#   emulator.start()
+#   sc = tellie_server.SerialCommand(emulator.port_name)
+#
+# SocketEmulator serves it on a TCP port instead, like
+# a ser2net bridge (connect to emulator.url), and
+# EmulatorPort is an in-process port for it, opened by
+# SerialCommand("emulator://") (see serial_transport.py).
+#
+# The echo latency can be set, pulse trains sped up
+# (time_scale) and faults (dropped or corrupted echoes,
+# power loss) injected at random.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import heapq
+import os
+import random
+import select
+import socket
+import threading
+import time
+import tty
+from common import parameters as p
+from common import clock as tellie_clock
+
+# Fault types, each injected with a probability per echoed command
+DROP_ECHO = "drop_echo"         # no echo at all
+CORRUPT_ECHO = "corrupt_echo"   # echo a wrong char
+POWER_LOSS = "power_loss"       # echo '\x00' and lose all settings
+
+# Commands followed by one argument char, echoed with the command char
+_single_arg = [p._cmd_pulse_height_hi, p._cmd_pulse_height_lo,
+               p._cmd_pulse_width_hi, p._cmd_pulse_width_lo,
+               p._cmd_pulse_number_hi, p._cmd_pulse_number_lo,
+               p._cmd_trigger_delay, p._cmd_fibre_delay]
+# Commands without arguments, echoed as sent
+_echoed = [p._cmd_pulse_height_end, p._cmd_pulse_width_end,
+           p._cmd_channel_clear, p._cmd_disable_ext_trig, p._cmd_enable_ext_trig]
+
+
+class SNO6CEmulator(object):
+    """The command parser and state of one control box.
+
+    feed() passes it the bytes written by the host, pop_output() gets
+    the bytes it has sent back by the given time.
+    """
+
+    def __init__(self, echo_latency=p._echo_latency, faults=None, seed=None, clock=time.time,
+                 time_scale=1.):
+        self.echo_latency = echo_latency
+        self.time_scale = time_scale
+        self.faults = faults or {}
+        self.clock = clock
+        self._random = random.Random(seed)
+        self._output = []  # heap of (due time, order, data)
+        self._order = 0
+        self._power_on()
+        self._parser = self._parse()
+        self._parser.next()
+
+    def _power_on(self):
+        self.channels = []
+        self.pulse_height = {}
+        self.pulse_width = {}
+        self.fibre_delay = {}
+        self.pulse_number = 0
+        self.pulse_delay = 0.
+        self.trigger_delay = 0
+        self.temp_probe = None
+        self.firing = False
+        self._last_pin = {}
+        self._hi = 0
+
+    def feed(self, data):
+        """Handle bytes written by the host"""
+        for c in data:
+            self._parser.send(c)
+
+    def next_due(self):
+        """Time the next output is due, None if there is none"""
+        if not self._output:
+            return None
+        return self._output[0][0]
+
+    def pop_output(self, now=None):
+        """Get everything sent back by now"""
+        if now is None:
+            now = self.clock()
+        data = ''
+        while self._output and self._output[0][0] <= now:
+            data += heapq.heappop(self._output)[2]
+        return data
+
+    def _send(self, data, delay=None):
+        if delay is None:
+            delay = self.echo_latency
+        self._order += 1
+        heapq.heappush(self._output, (self.clock() + delay, self._order, data))
+
+    def _echo(self, data):
+        """Send an echo, unless a fault is injected"""
+        if self._fault(POWER_LOSS):
+            self._power_on()
+            self._output = []
+            self._send('\x00')
+        elif self._fault(DROP_ECHO):
+            pass
+        elif self._fault(CORRUPT_ECHO):
+            self._send('?' * len(data))
+        else:
+            self._send(data)
+
+    def _fault(self, fault):
+        return self._random.random() < self.faults.get(fault, 0.)
+
+    def _box(self, channel):
+        return str((channel - 1) / 8 + 1)
+
+    def _parse(self):
+        """Generator handling one byte per send()"""
+        while True:
+            c = yield
+            if c == p._cmd_channel_select_single_start:
+                channel = ord((yield))
+                end = yield
+                self.channels = [channel]
+                self._echo(p._cmd_disable_ext_trig + self._box(channel) + end)
+            elif c == p._cmd_channel_select_many_start:
+                channels = []
+                c = yield
+                while c != p._cmd_channel_select_many_end:
+                    channels.append(ord(c))
+                    c = yield
+                self.channels = channels
+                self._echo(p._cmd_disable_ext_trig + self._box(channels[0]) + c)
+            elif c in _single_arg:
+                self._set(c, ord((yield)))
+                self._echo(c)
+            elif c in _echoed:
+                self._set(c, None)
+                self._echo(c)
+            elif c == p._cmd_pulse_delay:
+                ms = ord((yield))
+                self._echo(c)
+                us = ord((yield)) # not echoed
+                self.pulse_delay = ms + us / 250.
+            elif c in (p._cmd_temp_select_lower, p._cmd_temp_select_upper):
+                probe = ord((yield))
+                self.temp_probe = probe if c == p._cmd_temp_select_lower else probe + 32
+            elif c in (p._cmd_temp_read_lower, p._cmd_temp_read_upper):
+                self._send("%.2f\n" % self._temperature(), p._short_pause)
+            elif c in (p._cmd_fire_average_lower, p._cmd_fire_average_upper):
+                self._fire_sequence()
+            elif c == p._cmd_fire_series:
+                self._echo(c)
+                self.firing = True
+                self._send(p._buffer_end_sequence, self._sequence_time())
+            elif c in (p._cmd_read_single_lower, p._cmd_read_single_upper):
+                if self.channels:
+                    self._send("%d\n" % self._pin(self.channels[0])[0])
+            elif c == p._cmd_fire_continuous:
+                self.firing = True
+            elif c == p._cmd_stop:
+                # Readouts still to come are lost
+                self._output = [out for out in self._output if out[0] <= self.clock()]
+                heapq.heapify(self._output)
+                self.firing = False
+
+    def _set(self, c, value):
+        channel = self.channels[0] if len(self.channels) == 1 else None
+        if c in (p._cmd_pulse_height_hi, p._cmd_pulse_width_hi, p._cmd_pulse_number_hi):
+            self._hi = value
+        elif c == p._cmd_pulse_height_lo:
+            self.pulse_height[channel] = (self._hi << 8) + value
+        elif c == p._cmd_pulse_width_lo:
+            self.pulse_width[channel] = (self._hi << 8) + value
+        elif c == p._cmd_pulse_number_lo:
+            self.pulse_number = self._hi * value
+        elif c == p._cmd_trigger_delay:
+            self.trigger_delay = value * 5
+        elif c == p._cmd_fibre_delay:
+            self.fibre_delay[channel] = value / 4.
+        elif c == p._cmd_channel_clear:
+            self.channels = []
+
+    def _sequence_time(self):
+        duration = self.pulse_number * (self.pulse_delay * 1e-3 + p._sequence_overhead)
+        return duration * self.time_scale
+
+    def _fire_sequence(self):
+        if len(self.channels) != 1:
+            return
+        self.firing = True
+        pin, rms = self._pin(self.channels[0])
+        # The end of sequence marker, then the averaged readout
+        self._send(p._buffer_end_sequence + "%d %.1f\n" % (pin, rms), self._sequence_time())
+
+    def _pin(self, channel):
+        """Toy PIN model: brighter for narrower widths and higher heights"""
+        width = self.pulse_width.get(channel, p._max_pulse_width)
+        height = self.pulse_height.get(channel, 0)
+        mean = max(p._max_pulse_width - width, 0) * height / float(p._max_pulse_height) * 0.1
+        pin = max(int(round(self._random.gauss(mean, 1 + 0.01 * mean))), 0)
+        rms = 1 + 0.01 * mean
+        self._last_pin[channel] = pin
+        return pin, rms
+
+    def _temperature(self):
+        return 20. + 0.1 * (self.temp_probe or 0) + self._random.gauss(0, 0.05)
+
+
+class EmulatorPort(object):
+    """A serial port wired straight to an SNO6CEmulator, in process.
+
+    read(n) blocks until n bytes have been sent back or the timeout
+    passes, as for a pyserial port.  With a virtual clock (which should
+    also be the emulator's) the wait is skipped instead.
+    """
+
+    def __init__(self, emulator=None, timeout=None, clock=None):
+        self.emulator = emulator or SNO6CEmulator()
+        self.timeout = timeout
+        self._clock = clock or tellie_clock.real_clock
+        self.port = "emulator://"
+        self._buffer = ''
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def _collect(self):
+        self._buffer += self.emulator.pop_output()
+
+    def write(self, data):
+        with self._condition:
+            self.emulator.feed(data)
+            self._condition.notify_all()
+        return len(data)
+
+    def read(self, n=1):
+        end = None if self.timeout is None else self._clock.time() + self.timeout
+        with self._condition:
+            while True:
+                self._collect()
+                if len(self._buffer) >= n or self._closed:
+                    break
+                now = self._clock.time()
+                if end is not None and now >= end:
+                    break
+                # Short real waits: a timed Condition.wait polls, so would be slow to notice writes
+                wait = None if self._clock.virtual else p._echo_poll
+                if end is not None:
+                    wait = end - now if wait is None else min(wait, end - now)
+                due = self.emulator.next_due()
+                if due is not None:
+                    wait = max(due - now, 0) if wait is None else min(wait, max(due - now, 0))
+                if wait is None:
+                    # Virtual time with nothing due and no timeout: nothing will ever come
+                    break
+                self._clock.wait(self._condition, wait)
+            data, self._buffer = self._buffer[:n], self._buffer[n:]
+        return data
+
+    def inWaiting(self):
+        with self._condition:
+            self._collect()
+            return len(self._buffer)
+
+    def setRTS(self, level=True):
+        pass
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class _EmulatorServer(threading.Thread):
+    """Base of the threads passing bytes between a file descriptor and
+    an emulator.
+    """
+
+    def __init__(self, name, emulator):
+        super(_EmulatorServer, self).__init__(name=name)
+        self.daemon = True
+        self.emulator = emulator or SNO6CEmulator()
+        self._stop_flag = False
+
+    def stop(self):
+        self._stop_flag = True
+
+    def _pump(self, fd, read, write):
+        """Serve fd until stopped, returns False if the other end closed"""
+        while not self._stop_flag:
+            timeout = p._short_pause
+            due = self.emulator.next_due()
+            if due is not None:
+                timeout = min(max(due - time.time(), 0), timeout)
+            readable, _, _ = select.select([fd], [], [], timeout)
+            if readable:
+                data = read()
+                if not data:
+                    return False
+                self.emulator.feed(data)
+            output = self.emulator.pop_output()
+            if output:
+                write(output)
+        return True
+
+
+class PtyEmulator(_EmulatorServer):
+    """Serve an SNO6CEmulator on a pseudo-terminal, port_name is the
+    device to open in place of the control box's usb-serial port.
+    """
+
+    def __init__(self, emulator=None):
+        super(PtyEmulator, self).__init__("PtyEmulator", emulator)
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port_name = os.ttyname(self._slave)
+
+    def run(self):
+        self._pump(self._master,
+                   lambda: os.read(self._master, 1024),
+                   lambda data: os.write(self._master, data))
+        os.close(self._master)
+        os.close(self._slave)
+
+
+class SocketEmulator(_EmulatorServer):
+    """Serve an SNO6CEmulator on a TCP port, one client at a time, url
+    is the socket:// URL to open in place of the usb-serial port.
+    """
+
+    def __init__(self, emulator=None, host="localhost", port=0):
+        super(SocketEmulator, self).__init__("SocketEmulator", emulator)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(1)
+        self.address = self._server.getsockname()
+        self.url = "socket://%s:%d" % self.address
+
+    def run(self):
+        while not self._stop_flag:
+            readable, _, _ = select.select([self._server], [], [], p._short_pause)
+            if not readable:
+                continue
+            conn, _ = self._server.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                self._pump(conn, lambda: conn.recv(1024), conn.sendall)
+            except socket.error:
+                pass
+            conn.close()
+        self._server.close()
@@ -17,13 +17,25 @@
 ###########################################
 ###########################################
 from SimpleXMLRPCServer import SimpleXMLRPCServer
+import SimpleXMLRPCServer as xmlrpc_server
 import serial
 import tellie_exception
+import serial_reader
+import temp_scanner
+import event_publisher
+import metrics
+import serial_recorder
+import serial_transport
+import transaction_engine
+import power_recovery
 import re
 import sys
+import functools
 import time
-import math
+import threading
 from common import parameters as p
+from common import clock as tellie_clock
+from common import fire_plan as tellie_plan
 #from core import serial_command as s
 _snotDaqLog = False
 try:
@@ -55,13 +67,42 @@ class ThreadException(Exception):
         Exception.__init__(self, error)
 
 
+def _awaits_argument(chunk):
+    """Whether the box waits for an argument byte after this chunk (the
+    pulse delay sends its fraction of a ms as a chunk of its own)
+    """
+    return len(chunk) == 2 and chunk[0] == p._cmd_pulse_delay
+
+
+def _locked(method):
+    """Hold the command lock for the whole of a firing or readout method,
+    so nothing else (e.g. the temperature scan) uses the port part way
+    through
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+
 class SerialCommand(object):
     """Contains a serial command object.
     """
     
     # ####################
     # Function for easier logging
-    def log_phrase(self, phrase, severity=0, isSnotDaqLog=False):
+    def log_phrase(self, phrase, severity=0, isSnotDaqLog=False, args=()):
+        """Log at severity 0 (debug), 1 (notice) or 2 (warn).  Pass any
+        format arguments as args: the phrase is only formatted once the
+        message is known to be wanted.  Debug messages for snotdaq are
+        always sent, whatever the local debug mode.
+        """
+        if (severity == 0):
+            if not isSnotDaqLog and not self.logger_local.debug_enabled():
+                return
+        if args:
+            phrase = phrase % args
         if (severity == 0):
             if isSnotDaqLog:
                 self.logger.debug(phrase)
@@ -86,17 +127,42 @@ class SerialCommand(object):
             result = result + r + " "
         return result
 
-    def __init__(self, serial_port = p._serial_port, server_port = p._server_port, logger_port = p._logger_port, port_timeout = p._port_timeout):
+    def __init__(self, serial_port = p._serial_port, server_port = p._server_port, logger_port = p._logger_port, port_timeout = p._port_timeout,
+                 use_reader = p._reader_thread, warm_start = False, port = None, record = None,
+                 use_engine = p._serial_engine, clock = None):
         '''Initialise function: open serial connection.
+
+        serial_port is a device name or URL, e.g. socket://host:port
+        (see core/serial_transport.py).
+        use_reader starts a thread that drains the port into a buffer of
+        parsed events, rather than polling the port for readouts.
+        use_engine instead runs commands as transactions that read the
+        port from the calling thread (see core/transaction_engine.py).
+        warm_start skips the reset and test pulse if the box already
+        responds to a handshake.
+        port is an already open port to use instead (e.g. a
+        serial_recorder.ReplayPort), record a file to log all serial
+        traffic to (see core/serial_recorder.py).
+        clock is the time source for pauses and timeouts (see
+        common/clock.py), e.g. a VirtualClock with an emulated box.
+        The reader thread waits in real time, so a virtual clock needs
+        use_reader=False or use_engine.
         '''
+        stage_start = time.time()
+        self._startup_timing = []
         self._serial_port = serial_port
         self._port_timeout = port_timeout
+        self._use_reader = use_reader
+        self._use_engine = use_engine
+        self._clock = clock or tellie_clock.real_clock
+        if self._clock.virtual and use_reader and not use_engine:
+            raise TellieException("Cannot use the reader thread with a virtual clock")
         self._logger_port = logger_port
         
         #Setting local log file on snodrop
         self.logger_local = tellie_logger.TellieLogger.get_instance()
+        self.metrics = metrics.Metrics.get_instance()
         self.logger_local.set_log_file(p._server_log)
-        self.logger_local.set_debug_mode(True)
         
         # Set up logger stuff.
         if _snotDaqLog:
@@ -110,11 +176,27 @@ class SerialCommand(object):
         
         # Set up serial connection to tellie
         self._serial = None
-        try:
-            self._serial = serial.Serial(port=p._serial_port,timeout=p._port_timeout)
-            self.log_phrase("Serial connection open: %s" % self._serial, 0, _snotDaqLog)
-        except serial.SerialException, e:
-            raise TellieSerialException(e)
+        self._reader = None
+        self._engine = None
+        self._temp_scanner = None
+        # Held for each xmlrpc call and serial command, so that background
+        # threads (e.g. the temperature scanner) never interleave commands
+        self._lock = threading.RLock()
+        # Set by a stop, aborts the command holding the lock and any
+        # waiting for it, until the stop has cleaned up
+        self._abort = threading.Event()
+        # When the stop was asked for, and whether its stop byte has been written
+        self._stop_requested = None
+        self._stop_written = False
+        self._recovery = power_recovery.PowerRecovery(self)
+        self._recovering = False
+        if port is not None:
+            self._serial = port
+        else:
+            self._serial = self._open_port()
+        if record:
+            self._serial = serial_recorder.RecordingPort(self._serial, record)
+        self._start_reader()
 
         # Cache current settings - remove need to re-command where possible
         # Channel specific settings
@@ -131,6 +213,8 @@ class SerialCommand(object):
         # Information on whether the channel is being fired
         self._firing = 0 #must wait for firing to complete
         self._reading = 0 #once a read command has been sent, dont send again!
+        # Start of a sequence readout read without the reader thread
+        self._pin_partial = ''
 
         # Temperature settings
         self._current_temp_probe = None
@@ -139,16 +223,108 @@ class SerialCommand(object):
         # restriction only lifted once a fire command has been called
         self._force_setting = False
 
-        # Send a reset, to ensure the RTS is set to false
-        self.reset()
-        self.pulse_single_init_server()
+        stage_start = self._startup_stage("open serial", stage_start)
+        warm = False
+        if warm_start:
+            warm = self.handshake()
+            stage_start = self._startup_stage("handshake", stage_start)
+        if not warm:
+            # Send a reset, to ensure the RTS is set to false
+            self.reset()
+            stage_start = self._startup_stage("reset", stage_start)
+            self.pulse_single_init_server()
+            stage_start = self._startup_stage("test pulse", stage_start)
         # Send a clear channel command, just in case
         self._clear_buffer()
         self.clear_channel()
+        stage_start = self._startup_stage("clear channel", stage_start)
 
         #By default stop tellie waiting for external trigger (i.e. running in slave mode).
         #Slave mode can be re-instated later if required.
         self.disable_external_trigger()
+        stage_start = self._startup_stage("disable external trigger", stage_start)
+        total = sum(t for _, t in self._startup_timing)
+        self.log_phrase("Startup (%s) took %.3f s: %s", 1, _snotDaqLog,
+                        args=("warm" if warm else "cold", total,
+                              ", ".join("%s %.3f s" % (stage, t) for stage, t in self._startup_timing)))
+
+    def _startup_stage(self, stage, stage_start):
+        """Record the time taken by a startup stage, returns the time now"""
+        now = time.time()
+        self._startup_timing.append((stage, now - stage_start))
+        return now
+
+    def get_startup_timing(self):
+        """Get the (stage, seconds) breakdown of the server startup"""
+        return self._startup_timing
+
+    def handshake(self):
+        """Cheap check that the box is responding: send a command with a
+        known single char echo.  Returns True if the echo came back.
+        """
+        self._clear_buffer()
+        if self._reader:
+            self._reader.expect_echo(1)
+        self._serial_write(p._cmd_disable_ext_trig)
+        echo = self._read_echo(1, self._port_timeout)
+        if self._reader:
+            self._reader.clear_echo()
+        self.log_phrase("Handshake echo: %s", 0, _snotDaqLog, args=(self.parse_hex(echo),))
+        return echo == p._cmd_disable_ext_trig
+
+    def _start_reader(self):
+        """Set up reading the port: the transaction engine, the reader
+        thread or neither (polling)
+        """
+        self._engine = None
+        self._reader = None
+        if self._use_engine:
+            self._engine = transaction_engine.TransactionEngine(self._serial, self._serial_write, clock=self._clock)
+            # Also waits for readouts like the reader, reading as it goes
+            self._reader = self._engine
+        elif self._use_reader:
+            self._reader = serial_reader.SerialReader(self._serial)
+            self._reader.start()
+
+    def _open_port(self):
+        """Open the serial port or URL"""
+        try:
+            port = serial_transport.open_transport(self._serial_port, self._port_timeout, self._clock)
+        except (serial.SerialException, ValueError), e:
+            raise TellieSerialException(e)
+        self.log_phrase("Serial connection open: %s", 0, _snotDaqLog, args=(port,))
+        return port
+
+    def reconnect(self, serial_port=None):
+        """Re-open the serial link (e.g. after a network drop), or open
+        serial_port instead, keeping the settings cache.
+
+        Returns True if the box answers a handshake, otherwise the cache
+        is dropped as the box may have lost its settings.
+        """
+        with self._lock:
+            self.log_phrase("Reconnect to %s", 1, _snotDaqLog, args=(serial_port or self._serial_port,))
+            if serial_port:
+                self._serial_port = serial_port
+            if self._reader:
+                self._reader.stop()
+                self._reader.join()
+                self._reader = None
+            if isinstance(self._serial, serial_recorder.RecordingPort):
+                # Keep recording to the same log
+                self._serial.reopen(self._open_port())
+            else:
+                try:
+                    self._serial.close()
+                except Exception, e:
+                    self.log_phrase("Error closing serial port: %s", 1, _snotDaqLog, args=(e,))
+                self._serial = self._open_port()
+            self._start_reader()
+            if self.handshake():
+                return True
+            self.log_phrase("No handshake after reconnecting, settings cache dropped", 2, _snotDaqLog)
+            self.invalidate_settings()
+            return False
 
     def __del__(self):
         """Deletion function"""
@@ -163,17 +339,57 @@ class SerialCommand(object):
     
     def disconnect(self):
         """Disconnect from USB serial port"""
+        self.stop_temp_scanner()
+        if self._reader:
+            self._reader.stop()
+            self._reader.join()
+            self._reader = None
         if self._serial:
             self._serial.close()
 
     def test(self):
         self.log_phrase("Tellie server responding", 1, _snotDaqLog)
 
+    def _sleep(self, seconds):
+        """Sleep, counting the time slept"""
+        self._clock.sleep(seconds)
+        self.metrics.count("sleep_time", seconds)
+
+    def _serial_write(self, data):
+        """Write to the serial port, counting the bytes"""
+        written = self._serial.write(data)
+        self.metrics.count("bytes_written", len(data))
+        return written
+
+    def _serial_read(self, n):
+        """Read from the serial port, counting the bytes"""
+        data = self._serial.read(n)
+        self.metrics.count("bytes_read", len(data))
+        return data
+
+    def _check_abort(self):
+        """Fail the current command if a stop has been asked for, sending
+        the stop byte first.  Only call holding the lock, between commands
+        or at a chunk boundary the stop cannot be mistaken for an argument.
+        """
+        if self._abort.is_set():
+            self._write_stop()
+            raise TellieException("Stopped")
+
+    def _write_stop(self):
+        """Write the stop byte, once per stop, holding the lock"""
+        if self._stop_written:
+            return
+        self._serial_write(p._cmd_stop)
+        self._stop_written = True
+        self.metrics.record("stop_latency", time.time() - self._stop_requested)
+        self.log_phrase("Stop sent!", 0, _snotDaqLog)
+
     def _clear_buffer(self):
         """Clear any chars left in the buffer"""
         buffer_read = self.read_buffer()
         if buffer_read != "":
-            self.log_phrase("Buffer was not clear: %s" % buffer_read, 0, _snotDaqLog)
+            self.log_phrase("Buffer was not clear: %s", 0, _snotDaqLog, args=(buffer_read,))
 
     def _check_clear_buffer(self):
         """Many commands expect an empty buffer, fail if they are not!
@@ -185,78 +401,219 @@ class SerialCommand(object):
                 self.logger.warn("Buffer not clear: %s" % (buffer_read))
             self.logger_local.warn("Buffer not clear: %s" % (buffer_read))
 
+    def _read_echo(self, n, timeout):
+        """Read up to n echoed chars, returning as soon as they have arrived.
+        Returns whatever has been read if the timeout is reached first."""
+        if self._reader:
+            return self._reader.read_echo(n, timeout)
+        echo = ''
+        start = self._clock.time()
+        while len(echo) < n:
+            waiting = self._serial.inWaiting()
+            if waiting:
+                echo += self._serial_read(min(waiting, n - len(echo)))
+            elif (self._clock.time() - start) > timeout:
+                break
+            else:
+                self._sleep(p._echo_poll)
+        return echo
+
     def _send_command(self, command, readout=True, buffer_check=None, sleep_after_command=p._short_pause):
         """Send a command to the serial port.
         Command can be a chr/str (single write) or a list.
         Lists are used for e.g. a high/low bit command where
         the high bit could finish with an endline (i.e. endstream)
 
-        sleep_after_command is the default time to sleep between each write command"""
-        self.log_phrase("_send_command:%s" % command, 0, _snotDaqLog)
+        buffer_check is the expected echo (see chunk_echoes), by default the
+        command itself.
+
+        sleep_after_command is the default time to sleep between each write command.
+        In echo flow control mode it is instead the longest time to wait for the
+        echo of each write (commands without readout still sleep)."""
+        with self._lock:
+            with self.metrics.timer("serial.send_command"):
+                self._send_command_locked(command, readout, buffer_check, sleep_after_command)
+
+    def _send_command_locked(self, command, readout, buffer_check, sleep_after_command):
+        trace = self.logger_local.trace_enabled()
+        self.log_phrase("_send_command:%s", 0, _snotDaqLog, args=(command,))
 
         if type(command) is str:
             command = [command]
         if type(command) is not list:
             raise TellieException("Command is not a list: %s %s" % (command, type(command)))
+
+        # The echo read once each chunk has been written
+        echoes = chunk_echoes(command, buffer_check)
+        echo_offsets = []
+        for echo in echoes:
+            echo_offsets.append(len(echo) + (echo_offsets[-1] if echo_offsets else 0))
+        buffer_check = ''.join(echoes)
+
+        self._check_abort()
+        echo_mode = (p._flow_control == "echo" and readout is True)
+        buffer_read = ''
+        if self._engine and echo_mode:
+            buffer_read = self._transact(command, echoes, sleep_after_command)
+            command_chunks = []
+        else:
+            command_chunks = command
+        if self._reader and readout is True and command_chunks:
+            self._reader.expect_echo(len(buffer_check))
         #try:
-        for c in command:
-            self.log_phrase("Writing chars %s" % self.parse_hex(c), 0, _snotDaqLog)
-            bytesWritten = self._serial.write(c)
-            self.log_phrase("Written chars %s" % self.parse_hex(c), 0, _snotDaqLog)
-            self.log_phrase("Bytes written %d" % bytesWritten, 0, _snotDaqLog)
-            time.sleep(sleep_after_command)
+        for i, c in enumerate(command_chunks):
+            if i == 0 or not _awaits_argument(command_chunks[i-1]):
+                self._check_abort()
+            bytesWritten = self._serial_write(c)
+            if trace:
+                self.logger_local.trace("Written chars %s, bytes written %d" % (self.parse_hex(c), bytesWritten))
+            if not echo_mode:
+                self._sleep(sleep_after_command)
+            elif i < len(command)-1:
+                # Wait for this chunk's echo before writing the next chunk,
+                # the full echo is read once the final chunk is written
+                if len(buffer_read) < echo_offsets[i]:
+                    buffer_read += self._read_echo(echo_offsets[i]-len(buffer_read), sleep_after_command)
         #except Exception as e:
         #    raise TellieException("Lost connection with TELLIE hardware! Re-set server")
 
-        if not buffer_check: # assume returns same as input
-            buffer_check = ''
-            for c in command:
-                buffer_check += c
-
         if readout is True:
             # One read command (with default timeout of 0.1s) should be
             # enough to get all the chars from the readout.
-            buffer_read = self._serial.read(len(buffer_check))
+            if echo_mode or self._reader:
+                buffer_read += self._read_echo(len(buffer_check)-len(buffer_read), self._port_timeout)
+            else:
+                buffer_read = self._serial_read(len(buffer_check))
             attempt = 0
-            self.log_phrase("READ: %s\tCHECK: %s" % (buffer_read, buffer_check), 0, _snotDaqLog)
-            while (len(buffer_read) != len(buffer_check)) and attempt<10:
+            if trace:
+                self.logger_local.trace("READ: %s\tCHECK: %s" % (self.parse_hex(buffer_read), self.parse_hex(buffer_check)))
+            while (len(buffer_read) != len(buffer_check)) and attempt<10 and '\x00' not in buffer_read:
+                self._check_abort()
                 self.log_phrase("Didn't read correct no of chars, read again", 0, _snotDaqLog)
                 # First, try reading again
-                time.sleep(p._short_pause)
-                buffer_read += self._serial.read(len(buffer_check))
+                self.metrics.count("echo_retries")
+                self._sleep(p._short_pause)
+                if self._reader:
+                    buffer_read += self._read_echo(len(buffer_check)-len(buffer_read), self._port_timeout)
+                else:
+                    buffer_read += self._serial_read(len(buffer_check))
                 attempt += 1
+            if self._reader:
+                self._reader.clear_echo()
 
             if str(buffer_read)!=str(buffer_check):
-                self.log_phrase("problem reading buffer, send %s, read %s" % (command, buffer_read), 0, _snotDaqLog)
+                # The stop cleans up after an aborted command
+                self._check_abort()
+                self.log_phrase("problem reading buffer, send %s, read %s", 0, _snotDaqLog, args=(command, buffer_read))
+                self.metrics.count("buffer_mismatches")
                 #clear anything else that might be in there
-                time.sleep(p._short_pause)
+                self._sleep(p._short_pause)
                 remainder = self.read_buffer()
-                self._serial.write(p._cmd_stop) # send a stop
-                time.sleep(p._short_pause)
-                self._serial.write(p._cmd_channel_clear) # send a clear
-                time.sleep(p._short_pause)
+                self._serial_write(p._cmd_stop) # send a stop
+                self._sleep(p._short_pause)
+                self._serial_write(p._cmd_channel_clear) # send a clear
+                self._sleep(p._short_pause)
                 self.read_buffer()
-                if buffer_read == '\x00':
+                if '\x00' in buffer_read:
                     self.log_phrase("Looks like power was lost to tellie...It may still be off?", 2, _snotDaqLog)
-                    # Re-run 
-                    self._send_command(command, readout, buffer_check, sleep_after_command)
+                    self.metrics.count("power_losses")
+                    if self._recovering:
+                        # Let the recovery retry
+                        raise TellieException("Power lost again during recovery")
+                    if self._recover_power(lambda: self._send_command_locked(command, readout, echoes,
+                                                                             sleep_after_command)):
+                        return
+                    raise TellieException("Power lost to tellie, settings could not be restored")
                 message = "Unexpected buffer output:\nsaw: %s, remainder %s\nexpected: %s\n" % (buffer_read, remainder, buffer_check)
                 self.log_phrase(message, 2, _snotDaqLog)
                 self.disable_external_trigger()
                 self.clear_channel()
                 raise TellieException(message)
             else:
-                self.log_phrase("success reading buffer: %s" % buffer_read, 0, _snotDaqLog)
+                self.log_phrase("success reading buffer: %s", 0, _snotDaqLog, args=(buffer_read,))
         else:
             self.log_phrase("not a readout command", 0, _snotDaqLog)
 
+    def _recover_power(self, resume):
+        """Run the power loss recovery (see core/power_recovery.py)"""
+        self._recovering = True
+        try:
+            return self._recovery.recover(resume)
+        finally:
+            self._recovering = False
+
+    def known_good_settings(self):
+        """Get the cached settings as a set_settings list, and the selected channels"""
+        settings = []
+        for channel in range(1, len(self._current_pulse_width)):
+            known = []
+            for name in ("pulse_height", "pulse_width", "fibre_delay"):
+                value = getattr(self, setting_commands[name][2])[channel]
+                if value is not None and value != -999:
+                    known.append((name, value))
+            if known:
+                settings += [("channel", channel)] + known
+        for name in ("pulse_number", "pulse_delay", "trigger_delay"):
+            value = getattr(self, setting_commands[name][2])
+            if value is not None:
+                settings.append((name, value))
+        return settings, list(self._channel)
+
+    def invalidate_settings(self):
+        """Forget everything about the box's state, e.g. after it lost power"""
+        for channel in range(len(self._current_pulse_width)):
+            self.clear_channel_settings(channel)
+        self.clear_global_settings()
+        self._current_temp_probe = None
+        self._channel = []
+        self._firing = False
+        self._reading = False
+
+    def replay_settings(self, settings, channels):
+        """Send known good settings in one batch, then select channels"""
+        if len(channels) == 1:
+            settings = settings + [("channel", channels[0])]
+        self.set_settings(settings)
+        if len(channels) > 1:
+            self.select_channels(channels)
+
+    def get_recovery_state(self):
+        """Get the power loss recovery state and recent history"""
+        return self._recovery.get_state()
+
+    def _transact(self, command, echoes, sleep_after_command):
+        """Run a command as a transaction engine transaction, returns the
+        echo read.  echoes is the echo of each chunk.  If it timed out the
+        echo is partial: the rest of the command is sent as on the polled
+        path, and the rest of the echo is still expected as echo so the
+        retries read it.
+        """
+        transaction = transaction_engine.Transaction(command, echoes,
+                                                     timeout=sleep_after_command * (len(command) - 1) + self._port_timeout)
+        try:
+            return self._engine.transact(transaction, self._abort.is_set)
+        except transaction_engine.TransactionCancelled:
+            if 0 < transaction.written < len(command) and _awaits_argument(command[transaction.written-1]):
+                # Finish the argument, so the stop is read as a command
+                self._serial_write(command[transaction.written])
+            self._check_abort()
+            raise TellieException("Stopped")
+        except transaction_engine.TransactionTimeout:
+            echo = transaction.echo
+            for i in range(transaction.written, len(command)):
+                if not _awaits_argument(command[i-1]):
+                    self._check_abort()
+                self._serial_write(command[i])
+                if i < len(command)-1 and len(echo) < transaction.offsets[i]:
+                    echo += self._read_echo(transaction.offsets[i]-len(echo), sleep_after_command)
+            return echo
+
     def _send_setting_command(self, command, buffer_check=None, while_fire=False):
         """Send non-firing command.
         All of these should have a clear buffer before being used.  Can set
         while_fire to True to allow a non-fire command to be sent while firing
         (will cause PIN readout to be flushed to buffer).
         """
-        self.log_phrase("Send non-firing command", 0, _snotDaqLog)
         if self._firing is True:
             if while_fire is False:
                 raise TellieException("Cannot run command, in firing mode")
@@ -272,7 +629,7 @@ class SerialCommand(object):
         Can set while_fire to True to allow a non-fire command to be sent
         while firing (will cause PIN readout to be flushed to buffer).
         """
-        self.log_phrase("Send global setting command %s" % (command), 0, _snotDaqLog)
+        self.log_phrase("Send global setting command %s", 0, _snotDaqLog, args=(command,))
         self._send_setting_command(command=command, buffer_check=buffer_check, while_fire=while_fire)
 
     def _send_channel_setting_command(self, command, buffer_check=None, while_fire=False):
@@ -280,7 +637,7 @@ class SerialCommand(object):
         Can set while_fire to True to allow a non-fire command to be sent while
         firing (will cause PIN readout to be flushed to buffer).
         """
-        self.log_phrase("Send channel setting command %s" % (command), 0, _snotDaqLog)
+        self.log_phrase("Send channel setting command %s", 0, _snotDaqLog, args=(command,))
 
         if not self._channel or self._channel == []:
             raise TellieException("Cannot run channel command, no channel selected")
@@ -295,12 +652,16 @@ class SerialCommand(object):
         """
         self.log_phrase("Reset!", 0, _snotDaqLog)        
 
-        self._serial.setRTS(True)
-        # sleep, just in case
-        time.sleep(p._medium_pause)
-        self._serial.setRTS(False)
-        # close the port and reopen?
-        time.sleep(p._medium_pause)
+        try:
+            self._serial.setRTS(True)
+            # sleep, just in case
+            self._sleep(p._medium_pause)
+            self._serial.setRTS(False)
+            # close the port and reopen?
+            self._sleep(p._medium_pause)
+        except IOError, e:
+            # e.g. a pseudo-terminal (see core/sno6c_emulator.py) has no RTS line
+            self.log_phrase("Port does not support RTS, no reset: %s", 1, _snotDaqLog, args=(e,))
         self.disable_external_trigger()
 
     def enable_external_trig(self, while_fire=False):
@@ -317,23 +678,24 @@ class SerialCommand(object):
         """Disable the external trigger"""
         self._send_command(command=p._cmd_disable_ext_trig)
 
+    @_locked
     def trigger_single(self):
         """Fire single pulse upon receiving an external trigger.
 
         """
         if self._firing is True:
             raise TellieException("Cannot fire, already in firing mode")
-        self._send_command(p._cmd_fire_ext_trig, False)
-        self._firing = True
-        time.sleep(p._short_pause)
+        self._send_fire(p._cmd_fire_ext_trig)
+        self._sleep(p._short_pause)
         pin = self.read_pin(self._channel[0])
         while not pin:
             pin = self.read_pin(self._channel[0])
         return pin
 
+    @_locked
     def trigger_averaged(self):
         """Request averaged pin reading for externally triggered pulses."""
-        self.log_phrase("Accepting %i triggers for averaging!" % self._current_pulse_number, 0, _snotDaqLog)
+        self.log_phrase("Accepting %i triggers for averaging!", 0, _snotDaqLog, args=(self._current_pulse_number,))
         if len(self._channel)!=1:
             self.log_phrase("Cannot fire with >1 channel! Averaging request denied.", 2, _snotDaqLog)
             return
@@ -344,9 +706,9 @@ class SerialCommand(object):
             cmd = p._cmd_fire_average_ext_trig_lower
         else:
             cmd = p._cmd_fire_average_ext_trig_upper
-        self._send_command(cmd, False)
-        self._firing = True
+        self._send_fire(cmd)
 
+    @_locked
     def fire(self, while_fire=False):
         """Fire tellie, place class into firing mode.
         Can send a fire command while already in fire mode if required."""
@@ -364,10 +726,11 @@ class SerialCommand(object):
             buffer_check += p._buffer_end_sequence
             self._send_command(p._cmd_fire_series, buffer_check=buffer_check)
         else:
-            self._send_command(p._cmd_fire_series, buffer_check=buffer_check)
-            self._firing = True #still firing
+            self._send_fire(p._cmd_fire_series, True, buffer_check) #still firing
         self._force_setting = False
+        event_publisher.publish(event_publisher.FIRING, mode="series", channels=self._channel)
 
+    @_locked
     def fire_sequence(self, while_fire=False):
         """Fire in sequence mode, can only be done for a single channel.
         """
@@ -385,10 +748,13 @@ class SerialCommand(object):
             cmd = p._cmd_fire_average_lower
         else:
             cmd = p._cmd_fire_average_upper
-        self._send_command(cmd, False)
-        self._firing = True
+        self._send_fire(cmd)
         self._force_setting = False
+        event_publisher.publish(event_publisher.FIRING, mode="sequence", channels=self._channel,
+                                pulse_number=self._current_pulse_number,
+                                pulse_delay=self._current_pulse_delay)
 
+    @_locked
     def fire_single(self):
         """Fire single pulse
         """
@@ -399,53 +765,113 @@ class SerialCommand(object):
             cmd = p._cmd_fire_single_lower
         else:
             cmd = p._cmd_fire_single_upper
-        self._send_command(cmd, False)
-        self._firing = True
+        self._send_fire(cmd)
         pin = self.read_pin(self._channel[0])
         while not pin:
             pin = self.read_pin(self._channel[0])
         return pin
 
+    @_locked
     def fire_continuous(self):
         """Fire Tellie in continous mode.
         """
         self.disable_external_trigger()
         if self._firing is True:
             raise TellieException("Cannot fire, already in firing mode")
-        self._send_command(p._cmd_fire_continuous, False)
-        self._firing = True
+        self._send_fire(p._cmd_fire_continuous)
         self._force_setting = False
+        event_publisher.publish(event_publisher.FIRING, mode="continuous", channels=self._channel)
+
+    def _send_fire(self, command, readout=False, buffer_check=None):
+        """Send a command that leaves the box firing.  Firing mode is set
+        first, so the temperature scan never mistakes the readout for a
+        temperature.
+        """
+        self._firing = True
+        self._pin_partial = ''
+        try:
+            self._send_command(command, readout, buffer_check)
+        except:
+            self._firing = False
+            raise
 
     def read_buffer(self, n=p._read_bytes):
-        return self._serial.read(n)
+        if self._reader:
+            # Everything the reader has not handed out yet
+            return self._reader.drain()
+        return self._serial_read(n)
+
+    def _end_of_sequence(self):
+        """Check whether the end of sequence marker has been read"""
+        if self._reader:
+            return self._reader.wait_for(serial_reader.END_SEQUENCE, 0) is not None
+        return self.read_buffer() == p._buffer_end_sequence
+
+    def stop_now(self, requested=None):
+        """Stop ahead of any command in progress or waiting for the serial
+        port, which then fail with "Stopped".  The stop byte is sent at
+        once if the port is free, otherwise by the command using it at its
+        next chunk boundary (or as it gives up waiting).
+
+        Must be followed by stop() to clean up.  requested is the time the
+        stop was asked for (e.g. when the request was read), the latency
+        to the stop byte being written is recorded as stop_latency.  Time
+        the request spent before the server read it (e.g. in the single
+        threaded server's socket backlog) is not included.
+        """
+        if self._abort.is_set():
+            return 0
+        self._stop_requested = requested if requested is not None else time.time()
+        self._stop_written = False
+        self._abort.set()
+        if self._lock.acquire(False):
+            try:
+                self._write_stop()
+            finally:
+                self._lock.release()
+        return 0
 
     def stop(self):
         """Stop firing tellie"""
         self.log_phrase("Stop firing!", 0, _snotDaqLog)
-        #Disable external trigger before we do anything
-        self._send_command(p._cmd_stop, False)
-        time.sleep(p._short_pause)
+        self.stop_now()
+        # Waits for any aborted command to give up the port
+        with self._lock:
+            self._write_stop()
+            self._abort.clear()
+            return self._stop_cleanup()
+
+    def _stop_cleanup(self):
+        self._sleep(p._short_pause)
         buffer_contents = self.read_buffer()
         self.disable_external_trigger()
+        # clear_channel empties self._channel, keep the list to invalidate
+        channels = self._channel
         self.clear_channel()
-        for c in self._channel:
+        for c in channels:
             self.clear_channel_settings(c)
         self.clear_global_settings()
         self._channel = []
         self._firing = False
+        # No readout comes after a stop
+        self._reading = False
+        self._pin_partial = ''
+        event_publisher.publish(event_publisher.STOP, channels=channels)
         return buffer_contents
 
+    @_locked
     def read_pin(self, channel=None, timeout=p._medium_pause, final=True):
         """Read the pin diode output, should always follow a fire command,
         Provide channel number to select specific channel, otherwise, receive dict of all channels"""
         self.log_phrase("Read PINOUT", 0, _snotDaqLog)
         #if in firing mode, check the buffer shows the sequence has ended
         if self._firing:
-            if self.read_buffer() == p._buffer_end_sequence:
-                print "K in buffer"
+            if self._end_of_sequence():
+                self.log_phrase("K in buffer", 0, _snotDaqLog)
                 self._firing = False
+                event_publisher.publish(event_publisher.SEQUENCE_END, channels=self._channel)
             else:
-                print "No K in buffer"
+                self.log_phrase("No K in buffer", 0, _snotDaqLog)
                 return None
         if channel:
             if self._reading is True:
@@ -454,22 +880,29 @@ class SerialCommand(object):
             else:
                 self.select_channel(channel)
             if self._channel[0] <= 56: #up to box 7
-                print "read!"
+                self.log_phrase("read!", 0, _snotDaqLog)
                 cmd = p._cmd_read_single_lower
             else:
-                print "read!"
+                self.log_phrase("read!", 0, _snotDaqLog)
                 cmd = p._cmd_read_single_upper
             if not self._reading:
                 self._send_command(cmd, False)
             pattern = re.compile(r"""\d+""")
-            start = time.time()
+            start = self._clock.time()
             pin = []
-            while (time.time()-start)<timeout:
-                output = self.read_buffer()
-                pin = pattern.findall(output)
-                if len(pin):
-                    break
-                time.sleep(p._short_pause)
+            if self._reader:
+                event = self._reader.wait_for(serial_reader.PIN, timeout, self._abort.is_set)
+                self._check_abort()
+                if event:
+                    pin = pattern.findall(event.raw)
+            else:
+                while (self._clock.time()-start)<timeout:
+                    self._check_abort()
+                    output = self.read_buffer()
+                    pin = pattern.findall(output)
+                    if len(pin):
+                        break
+                    self._sleep(p._short_pause)
             if len(pin) == 0:
                 self._reading = True
                 return None
@@ -483,6 +916,7 @@ class SerialCommand(object):
             self._reading = False
             if final is True:
                 self._firing = False
+            event_publisher.publish(event_publisher.PIN, pin=float(pin[0]), rms=None, channels=[channel])
             return pin[0], channel
             # May want to include RMS values:
 	        #rms_val = str(pin[1])+"."+str(pin[2])
@@ -503,15 +937,35 @@ class SerialCommand(object):
                 #channel_dict[channel] = [pin,rms_val]
             return channel_dict, channel_list
 
-    def read_pin_sequence(self):
+    @_locked
+    def read_pin_sequence(self, timeout=p._buffer_pause):
         """Read a pin from the sequence firing mode only.
+        With the reader thread, waits up to timeout for the readout.
         """
         self.log_phrase("Read PINOUT sequence", 0, _snotDaqLog)
         if self._firing is not True:
             raise TellieException("Cannot read pin, not in firing mode")
-        time.sleep(p._buffer_pause)
-        output = self.read_buffer()
-        self.log_phrase("BUFFER: %s" % output, 0, _snotDaqLog)
+        if self._reader:
+            # Returns as soon as the readout arrives
+            event = self._reader.wait_for(serial_reader.PIN, timeout, self._abort.is_set)
+            self._check_abort()
+            output = event.raw if event else ''
+            if event:
+                # Claim the end of sequence marker sent before it
+                self._reader.wait_for(serial_reader.END_SEQUENCE, 0)
+        else:
+            self._wait_unless_stopped(min(timeout, p._buffer_pause))
+            data = self.read_buffer().replace(p._buffer_end_sequence, '')
+            # As the reader's parser: the readout is complete at a line
+            # end, or once the line goes quiet
+            self._pin_partial += data
+            if '\n' in self._pin_partial:
+                output, self._pin_partial = self._pin_partial.split('\n', 1)
+            elif data == '':
+                output, self._pin_partial = self._pin_partial, ''
+            else:
+                output = ''
+        self.log_phrase("BUFFER: %s", 0, _snotDaqLog, args=(output,))
         numbers = output.split()
         if len(numbers) == 0:
             self.log_phrase("Sequence doesn't appear to have finished..", 0, _snotDaqLog)
@@ -521,26 +975,91 @@ class SerialCommand(object):
                 pin = float(numbers[0])
                 rms = float(numbers[1])
             except:
-                self.log_phrase("Unable to convert numbers to floats Numbers: %s Buffer: %s",str(numbers),output, 2, _snotDaqLog)
+                self.log_phrase("Unable to convert numbers to floats Numbers: %s Buffer: %s", 2, _snotDaqLog, args=(numbers, output))
                 return None
 
         else:
-            self.log_phrase("Bad number of PIN readouts: %s %s" % (len(numbers), numbers), 2, _snotDaqLog)
+            self.log_phrase("Bad number of PIN readouts: %s %s", 2, _snotDaqLog, args=(len(numbers), numbers))
             return None
         self._firing = False
-        value_dict = {self._channel[0]: pin}
-        rms_dict = {self._channel[0]: rms}
+        event_publisher.publish(event_publisher.SEQUENCE_END, channels=self._channel)
+        event_publisher.publish(event_publisher.PIN, pin=pin, rms=rms, channels=self._channel)
         return pin, rms, self._channel
 
+    def _wait_unless_stopped(self, seconds):
+        """Sleep, failing as soon as a stop is sent"""
+        start = self._clock.time()
+        self._clock.wait(self._abort, seconds)
+        self.metrics.count("sleep_time", self._clock.time() - start)
+        self._check_abort()
+
+    def sequence_duration(self):
+        """Expected time (s) to fire the loaded sequence"""
+        if self._current_pulse_number is None or self._current_pulse_delay is None:
+            raise TellieException("Pulse number and delay must be set")
+        return self._current_pulse_number * (self._current_pulse_delay * 1e-3 + p._sequence_overhead)
+
+    @_locked
+    def fire_sequence_and_read(self, timeout=p._long_pause):
+        """Fire in sequence mode and wait for the sequence to end.
+
+        Waits for the expected sequence duration plus timeout seconds,
+        returns (pin, rms, channels) as soon as the readout arrives.
+        """
+        self.log_phrase("Fire sequence and read!", 0, _snotDaqLog)
+        deadline = self._clock.time() + self.sequence_duration() + timeout
+        if self.fire_sequence() == 0:
+            raise TellieException("Unable to fire sequence")
+        if not self._reader:
+            # Nothing to read until the sequence has ended
+            self._wait_unless_stopped(self.sequence_duration())
+        result = None
+        while result is None and self._clock.time() < deadline:
+            # Short waits, so that a stop is noticed
+            result = self.read_pin_sequence(timeout=min(max(deadline - self._clock.time(), 0), p._short_pause))
+            self._check_abort()
+        if result is None:
+            raise TellieException("Sequence did not finish within %s s" % (self.sequence_duration() + timeout))
+        return result
+
+    @_locked
+    def fire_plan(self, segments, timeout=p._long_pause):
+        """Fire a list of sequence segments back to back.
+
+        Each segment is a dict with "channels" (a single channel list),
+        "pulse_number", "pulse_delay" and "trigger_delay".  Returns the
+        results of each segment and the pulse weighted PIN/RMS of each
+        channel (keyed by channel string for xmlrpc).
+        """
+        self.log_phrase("Fire plan of %d segments", 0, _snotDaqLog, args=(len(segments),))
+        results = []
+        for segment in segments:
+            if len(segment["channels"]) != 1:
+                raise TellieException("Cannot fire sequence with channels %s" % (segment["channels"]))
+            channel = int(segment["channels"][0])
+            pulse_number = int(segment["pulse_number"])
+            if pulse_number == 0:
+                continue
+            self.set_settings([("channel", channel),
+                               ("pulse_number", pulse_number),
+                               ("pulse_delay", segment["pulse_delay"]),
+                               ("trigger_delay", segment["trigger_delay"])])
+            pin, rms, _ = self.fire_sequence_and_read(timeout)
+            results.append({"channel": channel,
+                            "pulse_number": pulse_number,
+                            "pin": pin,
+                            "rms": rms})
+        return tellie_plan.combine_segments(results)
+
     def check_ready(self):
         """Check that all settings have been set"""
         not_set = []
         for channel in self._channel:
-            if self._current_pulse_width[channel-1] is None:
+            if self._current_pulse_width[channel] is None:
                 not_set += ["Pulse width"]
-            if self._current_pulse_height[channel-1] is None:
+            if self._current_pulse_height[channel] is None:
                 not_set += ["Pulse height"]
-            if self._current_fibre_delay[channel-1] is None:
+            if self._current_fibre_delay[channel] is None:
                 not_set += ["Fibre delay"]
         if self._current_pulse_number is None:
             not_set += ["Pulse number"]
@@ -549,7 +1068,7 @@ class SerialCommand(object):
         if self._current_trigger_delay is None:
             not_set += ["Trigger delay"]
         if not_set != []:
-            self.log_phrase("The following parameters have not been set: %s" % not_set, 0, _snotDaqLog)
+            self.log_phrase("The following parameters have not been set: %s", 0, _snotDaqLog, args=(not_set,))
 
     def clear_channel(self):
         """Unselect the channel"""
@@ -559,9 +1078,9 @@ class SerialCommand(object):
 
     def clear_channel_settings(self, channel):
         """Clear settings for a specific channel"""
-        self._current_pulse_width[channel-1] = None
-        self._current_pulse_height[channel-1] = None
-        self._current_fibre_delay[channel-1] = None
+        self._current_pulse_width[channel] = None
+        self._current_pulse_height[channel] = None
+        self._current_fibre_delay[channel] = None
 
     def clear_global_settings(self):
         """Clear settings that affect all channels"""
@@ -578,9 +1097,9 @@ class SerialCommand(object):
                 #channel already selected
                 self.log_phrase("Channel already selected", 0, _snotDaqLog)
                 return 0
-        self.log_phrase("Select channel %s %s" % (channel, type(channel)), 0, _snotDaqLog)
+        self.log_phrase("Select channel %s %s", 0, _snotDaqLog, args=(channel, type(channel)))
         command, buffer_check = command_select_channel(channel)
-        self.log_phrase("About to send command %s, %s" % (command, buffer_check), 0, _snotDaqLog)
+        self.log_phrase("About to send command %s, %s", 0, _snotDaqLog, args=(command, buffer_check))
         self._send_command(command=command, buffer_check=buffer_check)
         self._channel = [channel]
         self.log_phrase("About to return", 0, _snotDaqLog)
@@ -588,17 +1107,16 @@ class SerialCommand(object):
 
     def select_channels(self, channels):
         """Select multiple channels, expects list for channels"""
-        self.log_phrase("Select channels %s %s" % (channels, type(channels)), 0, _snotDaqLog)
+        self.log_phrase("Select channels %s %s", 0, _snotDaqLog, args=(channels, type(channels)))
         self.clear_channel()
         command = p._cmd_channel_select_many_start
         for channel in channels:
-            print channel
             command += chr(channel)
         command += p._cmd_channel_select_many_end
         buffer_check = p._cmd_disable_ext_trig+str((int(channels[0])-1)/8+1)+p._cmd_channel_select_many_end
-        print "SEND CHANNELS", "CMD", command, "BUF", buffer_check
+        self.log_phrase("Send channels, command %s, buffer check %s", 0, _snotDaqLog, args=(command, buffer_check))
         self._send_command(command=command, buffer_check=buffer_check)
-        print "DONE!"
+        self.log_phrase("Channels selected", 0, _snotDaqLog)
         self._channel = channels
 
     def init_channel(self, channel, pulse_number, pulse_delay, trigger_delay,
@@ -609,16 +1127,13 @@ class SerialCommand(object):
         if self._firing:
             self.log_phrase("Currently in firing mode. Wait until firing has stopped before retrying channel init.", 0, _snotDaqLog)
             return 1
-        #####
-        # Not included here: large block of command/buffer check outputs from serial_command.py
-        #####
-        self.select_channel(int(channel))
-        self.set_pulse_number(int(pulse_number))
-        self.set_pulse_delay(float(pulse_delay))
-        self.set_trigger_delay(int(trigger_delay))
-        self.set_pulse_width(int(pulse_width))
-        self.set_pulse_height(int(pulse_height))
-        self.set_fibre_delay(float(fibre_delay))
+        self.set_settings([("channel", channel),
+                           ("pulse_number", pulse_number),
+                           ("pulse_delay", pulse_delay),
+                           ("trigger_delay", trigger_delay),
+                           ("pulse_width", pulse_width),
+                           ("pulse_height", pulse_height),
+                           ("fibre_delay", fibre_delay)])
 
         # Return a dump of the settings
         settings = {"channels": self._channel,
@@ -632,14 +1147,131 @@ class SerialCommand(object):
                                                     "fibre_delay": self._current_fibre_delay[c]}
         return settings
 
+    @_locked
+    def set_settings(self, settings):
+        """Send a batch of settings, checking one concatenated echo.
+
+        settings is a list of (name, value) pairs sent in order, name is
+        either "channel" or one of the keys in setting_commands.  Channel
+        settings apply to the channel selected at that point of the batch.
+        Values that are already set are skipped (unless forced) and the
+        settings cache is only updated once the whole echo has been verified.
+        """
+        self.log_phrase("Set settings %s", 0, _snotDaqLog, args=(settings,))
+        if self._firing is True:
+            raise TellieException("Cannot run command, in firing mode")
+        command, buffer_check = [], []
+        selected = self._channel
+        pending = {}
+        for name, value in settings:
+            if name == "channel":
+                value = int(value)
+                if selected == [value]:
+                    continue
+                command, buffer_check = command_append((command, buffer_check), command_select_channel(value))
+                selected = [value]
+                continue
+            if name not in setting_commands:
+                raise TellieException("Unknown setting: %s" % (name))
+            builder, cast, attribute, per_channel = setting_commands[name]
+            value = cast(value)
+            key = (name, None)
+            current = getattr(self, attribute)
+            if per_channel:
+                if len(selected) != 1:
+                    raise TellieException("Cannot set parameter with channels set as %s" % (selected))
+                key = (name, selected[0])
+                current = current[selected[0]]
+            current = pending.get(key, current)
+            if value == current and not self._force_setting:
+                self.log_phrase("%s: %s, already set", 0, _snotDaqLog, args=(name, value))
+                continue
+            command, buffer_check = command_append((command, buffer_check), builder(value))
+            pending[key] = value
+        if command == []:
+            return 0
+        self._check_clear_buffer()
+        try:
+            self._send_command(command=command, buffer_check=buffer_check)
+        except TellieException:
+            # Some of the batch may have reached the box, no longer trust the cache
+            for key in pending:
+                self._set_cached_setting(key, None)
+            raise
+        self._channel = selected
+        for key, value in pending.iteritems():
+            self._set_cached_setting(key, value)
+        return 0
+
+    def _set_cached_setting(self, key, value):
+        """Update the settings cache for a (name, channel) key"""
+        name, channel = key
+        attribute = setting_commands[name][2]
+        if channel is None:
+            setattr(self, attribute, value)
+        else:
+            getattr(self, attribute)[channel] = value
+
+    def get_settings_cache(self):
+        """Get the cached settings, None where a setting is unknown"""
+        def known(value):
+            return None if value == -999 else value
+        cache = {"channels": self._channel,
+                 "pulse_number": self._current_pulse_number,
+                 "pulse_delay": self._current_pulse_delay,
+                 "trigger_delay": self._current_trigger_delay,
+                 "force_setting": self._force_setting,
+                 "channel_settings": {}}
+        for c in range(len(self._current_pulse_width)):
+            settings = {"pulse_width": known(self._current_pulse_width[c]),
+                        "pulse_height": known(self._current_pulse_height[c]),
+                        "fibre_delay": known(self._current_fibre_delay[c])}
+            if settings.values() != [None]*3:
+                cache["channel_settings"][str(c)] = settings
+        return cache
+
+    def plan_settings(self, targets):
+        """Get the minimal list of settings needed to reach the targets
+        (see minimal_settings) and an estimate of the time to send them.
+        """
+        settings = minimal_settings(self.get_settings_cache(), targets)
+        return {"settings": settings,
+                "estimated_time": estimate_settings_time(settings)}
+
+    def apply_settings(self, targets):
+        """Plan and send the minimal settings to reach the targets"""
+        plan = self.plan_settings(targets)
+        self.set_settings(plan["settings"])
+        return plan
+
+    def batch(self, calls):
+        """Run a list of [method, params] calls in order, in one request.
+
+        Returns a list with [result] for each call, as for a multicall.
+        Stops at the first call to fail, the last entry is then a fault
+        struct (faultCode, faultString) and later calls are not run.
+        """
+        results = []
+        with self._lock:
+            for method, params in calls:
+                try:
+                    func = xmlrpc_server.resolve_dotted_attribute(self, method, False)
+                    results.append([func(*params)])
+                except:
+                    exc_type, exc_value = sys.exc_info()[:2]
+                    results.append({"faultCode": 1,
+                                    "faultString": "%s:%s" % (exc_type, exc_value)})
+                    break
+        return results
+
     def set_pulse_height(self, par):
         """Set the pulse height for the selected channel"""
         if len(self._channel) != 1:
             raise TellieException("Cannot set parameter with channels set as %s" % (self._channel))
         if par == self._current_pulse_height[self._channel[0]] and not self._force_setting:
-            self.log_phrase("Pulse height: %s,already set" % (par), 0, _snotDaqLog)
+            self.log_phrase("Pulse height: %s,already set", 0, _snotDaqLog, args=(par,))
         else:
-            self.log_phrase("Set pulse height %s %s" % (par, type(par)), 0, _snotDaqLog)
+            self.log_phrase("Set pulse height %s %s", 0, _snotDaqLog, args=(par, type(par)))
             command, buffer_check = command_pulse_height(par)
             self._send_channel_setting_command(command=command, buffer_check=buffer_check)
             self._current_pulse_height[self._channel[0]] = par
@@ -651,9 +1283,9 @@ class SerialCommand(object):
         if len(self._channel) != 1:
             raise TellieException("Cannot set parameter with channels set as %s" % (self._channel))
         if par == self._current_pulse_width[self._channel[0]] and not self._force_setting:
-            self.log_phrase("Pulse width: %s, already set" % (par), 0, _snotDaqLog)
+            self.log_phrase("Pulse width: %s, already set", 0, _snotDaqLog, args=(par,))
         else:
-            self.log_phrase("Set pulse width %s %s" % (par, type(par)), 0, _snotDaqLog)            
+            self.log_phrase("Set pulse width %s %s", 0, _snotDaqLog, args=(par, type(par)))            
             command, buffer_check = command_pulse_width(par)
             self._send_channel_setting_command(command=command, buffer_check=buffer_check)
             self._current_pulse_width[self._channel[0]] = par
@@ -664,9 +1296,9 @@ class SerialCommand(object):
         if len(self._channel) != 1:
             raise TellieException("Cannot set parameter with channels set as %s" % (self._channel))
         if par == self._current_fibre_delay[self._channel[0]] and not self._force_setting:
-            self.log_phrase("Fibre delay %s, already selected" % (par), 0, _snotDaqLog)
+            self.log_phrase("Fibre delay %s, already selected", 0, _snotDaqLog, args=(par,))
         else:
-            self.log_phrase("Set Fibre delay %s %s" % (par, type(par)), 0, _snotDaqLog)
+            self.log_phrase("Set Fibre delay %s %s", 0, _snotDaqLog, args=(par, type(par)))
             command, buffer_check = command_fibre_delay(par)
             self._send_channel_setting_command(command=command, buffer_check=buffer_check)
             self._current_fibre_delay[self._channel[0]] = par
@@ -675,9 +1307,9 @@ class SerialCommand(object):
     def set_pulse_number(self, par):
         """Set the number of pulses to fire (global setting)"""
         if par == self._current_pulse_number and not self._force_setting:
-            self.log_phrase("Number of pulses: %s already selected" % (par), 0, _snotDaqLog)
+            self.log_phrase("Number of pulses: %s already selected", 0, _snotDaqLog, args=(par,))
         else:
-            self.log_phrase("Set pulse number %s %s" % (par, type(par)), 0, _snotDaqLog)
+            self.log_phrase("Set pulse number %s %s", 0, _snotDaqLog, args=(par, type(par)))
             command, buffer_check = command_pulse_number(par)
             self._send_global_setting_command(command=command, buffer_check=buffer_check)
             self._current_pulse_number = par
@@ -686,9 +1318,9 @@ class SerialCommand(object):
     def set_pulse_delay(self, par):
         """Set the delay between pulses (global setting)"""
         if par == self._current_pulse_delay and not self._force_setting:
-            self.log_phrase("Pulse delay: %s, already selected" % (par), 0, _snotDaqLog)
+            self.log_phrase("Pulse delay: %s, already selected", 0, _snotDaqLog, args=(par,))
         else:
-            self.log_phrase("Set pulse delay %s %s" % (par, type(par)), 0, _snotDaqLog)
+            self.log_phrase("Set pulse delay %s %s", 0, _snotDaqLog, args=(par, type(par)))
             command, buffer_check = command_pulse_delay(par)
             self._send_global_setting_command(command=command, buffer_check=buffer_check)
             self._current_pulse_delay = par
@@ -697,9 +1329,9 @@ class SerialCommand(object):
     def set_trigger_delay(self, par):
         """Set the trigger delay (global setting)"""
         if par == self._current_trigger_delay and not self._force_setting:
-            self.log_phrase("Trigger delay: %s,already set" % (par), 0, _snotDaqLog)
+            self.log_phrase("Trigger delay: %s,already set", 0, _snotDaqLog, args=(par,))
         else:
-            self.log_phrase("Set trigger delay %s %s" % (par, type(par)), 0, _snotDaqLog)
+            self.log_phrase("Set trigger delay %s %s", 0, _snotDaqLog, args=(par, type(par)))
             command, buffer_check = command_trigger_delay(par)
             self._send_global_setting_command(command=command, buffer_check=buffer_check)
             self._current_trigger_delay = par
@@ -710,7 +1342,7 @@ class SerialCommand(object):
         if par == self._current_temp_probe and not self._force_setting:
             pass
         else:
-            self.log_phrase("Select temperature probe %s %s" % (par, type(par)), 0, _snotDaqLog)
+            self.log_phrase("Select temperature probe %s %s", 0, _snotDaqLog, args=(par, type(par)))
             command, buffer_check = command_select_temp(par)
             self._send_command(command=command, readout=False)
             self._current_temp_probe = par
@@ -732,22 +1364,60 @@ class SerialCommand(object):
             cmd = p._cmd_temp_read_upper
         else:
             raise TellieException("Temp probe not in known range")
+        if self._reader:
+            self._reader.expect_temp()
         self._send_command(command=cmd, readout=False)
         pattern = re.compile(r"""[-+]?\d*\.\d+|\d+""")
         #wait for a few seconds before reading out
         temp = None
-        start = time.time()
+        start = self._clock.time()
+        if self._reader:
+            # Gives up at once for a stop
+            event = self._reader.wait_for(serial_reader.TEMP, timeout, self._abort.is_set)
+            self._check_abort()
+            if event is None:
+                raise TellieException("Temperature read timeout!")
+            temp = pattern.findall(event.raw)
         while not temp:
+            self._check_abort()
             output = self.read_buffer()
-            self.log_phrase("Buffer: %s" % output, 0, _snotDaqLog)
+            self.log_phrase("Buffer: %s", 0, _snotDaqLog, args=(output,))
             temp = pattern.findall(output)
-            if time.time() - start > timeout:
+            if temp:
+                break
+            if self._clock.time() - start > timeout:
                 raise TellieException("Temperature read timeout!")
+            self._sleep(p._echo_poll)
         if len(temp)>1:
             raise TellieException("Bad number of temp readouts: %s %s" % (len(temp), temp))
         temp = float(temp[0])
+        event_publisher.publish(event_publisher.TEMPERATURE, probe=self._current_temp_probe, temp=temp)
         return temp
 
+    def start_temp_scanner(self, interval=p._temp_scan_interval):
+        """Read all temperature probes in the background, cycling through
+        them every interval seconds while the box is idle.
+        """
+        if self._temp_scanner:
+            return 0
+        self._temp_scanner = temp_scanner.TempScanner(self, interval)
+        self._temp_scanner.start()
+        return 0
+
+    def stop_temp_scanner(self):
+        """Stop the background temperature scan"""
+        if self._temp_scanner:
+            self._temp_scanner.stop()
+            self._temp_scanner = None
+        return 0
+
+    def get_temperatures(self, since=0):
+        """Get the scanned (time, temperature) readings newer than since,
+        keyed by probe number"""
+        if not self._temp_scanner:
+            raise TellieException("Temperature scanner is not running")
+        return self._temp_scanner.get_temperatures(since)
+
     #Method to do the single pulse when starting the server
     def pulse_single_init_server(self):
         self.select_channel(1)
@@ -762,29 +1432,59 @@ class SerialCommand(object):
         self.stop()
         self.clear_channel()
 
+    ########################################
+    # xmlrpc dispatch, each call holds the command lock
+    def _dispatch(self, method, params):
+        func = xmlrpc_server.resolve_dotted_attribute(self, method, False)
+        with self._lock:
+            try:
+                with self.metrics.timer("rpc." + method):
+                    return func(*params)
+            except Exception, e:
+                event_publisher.publish(event_publisher.ERROR, method=method, error=str(e))
+                raise
+
+    def _listMethods(self):
+        return xmlrpc_server.list_public_methods(self)
+
     ########################################
     # Commands just to check current settings
+    def get_metrics(self):
+        """Get the latencies and serial I/O counters (see core/metrics.py)"""
+        return self.metrics.get_metrics()
+
+    def reset_metrics(self):
+        """Restart the latencies and counters"""
+        self.metrics.reset()
+        return 0
+
     def get_pulse_delay(self):
         """Get the pulse delay
         """
         return self._current_pulse_delay
 
     def get_pulse_number(self):
-        """Get the pulse delay
+        """Get the pulse number
+        """
+        return self._current_pulse_number
+
+    def is_firing(self):
+        """Check if the box is currently firing
         """
-        return self._current_pn
+        return self._firing is True
         
 ##################################################
 # Command options and corresponding buffer outputs
 #
 # These are retained such that command chains may
 # be called (e.g. set all settings) before running
-# a buffer readout.
+# a buffer readout.  The buffer output is a list of
+# the echo of each command chunk (see chunk_echoes).
 
 def command_select_channel(par):
     """Get the command to select a single channel"""
     command = [p._cmd_channel_select_single_start+chr(par)+p._cmd_channel_select_single_end]
-    buffer_check = p._cmd_disable_ext_trig+str((int(par)-1)/8+1)+p._cmd_channel_select_single_end
+    buffer_check = [p._cmd_disable_ext_trig+str((int(par)-1)/8+1)+p._cmd_channel_select_single_end]
     return command, buffer_check
 
 
@@ -797,7 +1497,7 @@ def command_pulse_height(par):
     command = [p._cmd_pulse_height_hi+chr(hi)]
     command+= [p._cmd_pulse_height_lo+chr(lo)]
     command+= [p._cmd_pulse_height_end]
-    buffer_check = p._cmd_pulse_height_hi + p._cmd_pulse_height_lo + p._cmd_pulse_height_end
+    buffer_check = [p._cmd_pulse_height_hi, p._cmd_pulse_height_lo, p._cmd_pulse_height_end]
     return command, buffer_check
 
 
@@ -809,7 +1509,7 @@ def command_pulse_width(par):
     lo = par & 255  # binary AND operator
     command = [p._cmd_pulse_width_hi+chr(hi)]
     command+= [p._cmd_pulse_width_lo+chr(lo)+p._cmd_pulse_width_end]
-    buffer_check = p._cmd_pulse_width_hi + p._cmd_pulse_width_lo + p._cmd_pulse_width_end
+    buffer_check = [p._cmd_pulse_width_hi, p._cmd_pulse_width_lo + p._cmd_pulse_width_end]
     return command, buffer_check
 
 
@@ -824,7 +1524,7 @@ def command_pulse_number(par):
         raise TellieException("Invalid pulse number: %s" % (par))
     command = [p._cmd_pulse_number_hi+chr(hi)]
     command+= [p._cmd_pulse_number_lo+chr(lo)]
-    buffer_check = p._cmd_pulse_number_hi + p._cmd_pulse_number_lo
+    buffer_check = [p._cmd_pulse_number_hi, p._cmd_pulse_number_lo]
     return command, buffer_check
 
 
@@ -836,7 +1536,7 @@ def command_pulse_delay(par):
     us = int((par-ms)*250)
     command = [p._cmd_pulse_delay+chr(ms)]
     command+= [chr(us)]
-    buffer_check = p._cmd_pulse_delay
+    buffer_check = [p._cmd_pulse_delay, ''] # the fraction is not echoed
     return command, buffer_check
 
 
@@ -845,7 +1545,7 @@ def command_trigger_delay(par):
     if par > p._max_trigger_delay or par < 0:
         raise TellieException("Invalid trigger delay: %s" % par)
     command = [p._cmd_trigger_delay+chr(par/5)]
-    buffer_check = p._cmd_trigger_delay
+    buffer_check = [p._cmd_trigger_delay]
     return command, buffer_check
 
 
@@ -855,11 +1555,10 @@ def command_fibre_delay(par):
         raise TellieException("Invalid fibre delay: %s" % par)
     #parameters = ParametersClass()
     adjusted, adj_delay, setting = p.fibre_delay(par)
-    print "COMMAND", par, adjusted, adj_delay, setting
     if adjusted is True:
         raise TellieException("Invalid delay: %s" % (par))
     command = [p._cmd_fibre_delay+chr(setting)]
-    buffer_check = p._cmd_fibre_delay
+    buffer_check = [p._cmd_fibre_delay]
     return command, buffer_check
 
 
@@ -881,26 +1580,136 @@ def command_select_temp(par):
     return command, None # nothing in buffer
 
 
+# Setting name -> (command function, type, cache attribute, channel specific)
+setting_commands = {"pulse_number": (command_pulse_number, int, "_current_pulse_number", False),
+                    "pulse_delay": (command_pulse_delay, float, "_current_pulse_delay", False),
+                    "trigger_delay": (command_trigger_delay, int, "_current_trigger_delay", False),
+                    "pulse_width": (command_pulse_width, int, "_current_pulse_width", True),
+                    "pulse_height": (command_pulse_height, int, "_current_pulse_height", True),
+                    "fibre_delay": (command_fibre_delay, float, "_current_fibre_delay", True)}
+
+
 ##################################################
-# Helper functions (was only needed in serial_command)
-#def command_append(inputs, values):
-#    '''Pass in inputs as (command, buffer_check) and values to append.
+# Settings planning
 #
-#    Inputs should be a list.
-#    Command should be returned as a list, buffer_check as a string.
-#    '''
-#    assert len(inputs) == len(values)
-#    if type(inputs[0]) is not list:
-#        inputs[0] = [inputs[0]]
-#    if type(values[0]) is not list:
-#        inputs[0] += [values[0]]
-#    else:
-#        inputs[0] += values[0]
-#    inputs[1] = "%s%s" % (inputs[1], values[1])
-#    return inputs
+# Work out the minimal settings to send from a copy of the
+# SerialCommand settings cache (see get_settings_cache).
+
+global_settings = ["pulse_number", "pulse_delay", "trigger_delay"]
+channel_settings = ["pulse_width", "pulse_height", "fibre_delay"]
+
+# Characters take 10 bits at the (pyserial default) 9600 baud
+_char_time = 10. / 9600
+
+
+def minimal_settings(cache, targets):
+    """Get the (name, value) settings for set_settings that change the
+    cached settings to the targets, skipping anything already set.
+
+    targets can contain any global setting, "channel_settings" as a dict
+    of channel -> {setting: value}, and "channel" to leave selected.
+    """
+    force = cache.get("force_setting", False)
+    settings = []
+    for name in global_settings:
+        if name not in targets:
+            continue
+        value = setting_commands[name][1](targets[name])
+        if force or value != cache.get(name):
+            settings.append([name, value])
+    final = targets.get("channel")
+    if final is not None:
+        final = int(final)
+    selected = cache.get("channels", [])
+    changes = {}
+    for channel, target in targets.get("channel_settings", {}).iteritems():
+        current = cache.get("channel_settings", {}).get(str(channel), {})
+        for name in channel_settings:
+            if name not in target:
+                continue
+            value = setting_commands[name][1](target[name])
+            if force or value != current.get(name):
+                changes.setdefault(int(channel), []).append([name, value])
+    # Start on the selected channel and finish on the requested one
+    order = sorted(changes)
+    if final in changes:
+        order.remove(final)
+        order.append(final)
+    elif len(selected) == 1 and selected[0] in changes:
+        order.remove(selected[0])
+        order.insert(0, selected[0])
+    for channel in order:
+        if selected != [channel]:
+            settings.append(["channel", channel])
+            selected = [channel]
+        settings += changes[channel]
+    if final is not None and selected != [final]:
+        settings.append(["channel", final])
+    return settings
+
+
+def estimate_settings_time(settings):
+    """Estimated time (s) to send settings as one set_settings batch"""
+    if settings == []:
+        return 0.
+    if p._flow_control == "echo":
+        chunk_time = p._echo_latency
+    else:
+        chunk_time = p._short_pause
+    chars = 0
+    chunks = 0
+    for name, value in settings:
+        if name == "channel":
+            command, buffer_check = command_select_channel(int(value))
+        else:
+            command, buffer_check = setting_commands[name][0](setting_commands[name][1](value))
+        # Only chunks with an echo are waited for
+        chunks += len([echo for echo in buffer_check if echo])
+        chars += len(''.join(command)) + len(''.join(buffer_check))
+    return chunks * chunk_time + chars * _char_time
+
+
+##################################################
+# Helper functions
+def chunk_echoes(command, buffer_check):
+    '''Get the echo expected after each chunk of a command.
+
+    buffer_check is either a list with the echo of each chunk, a string
+    echoed once the last chunk is written or None if each chunk is
+    echoed as sent.
+    '''
+    if type(command) is not list:
+        command = [command]
+    if buffer_check is None: # assume returns same as input
+        return list(command)
+    if type(buffer_check) is str:
+        return [''] * (len(command) - 1) + [buffer_check]
+    return list(buffer_check)
+
+
+def command_append(inputs, values):
+    '''Pass in inputs as (command, buffer_check) and values to append.
+
+    Command is returned as a list, buffer_check as a list of the echo
+    of each chunk.
+    '''
+    command, buffer_check = inputs
+    value_command, value_check = values
+    if type(command) is not list:
+        command = [command]
+    if type(value_command) is not list:
+        value_command = [value_command]
+    return command + value_command, chunk_echoes(command, buffer_check) + chunk_echoes(value_command, value_check)
+
+# Chip types that can be selected in bin/tellie.py
+SNO6C = SerialCommand
+
 
 if __name__ == "__main__":
     runTime = time.time()
+    logger = tellie_logger.TellieLogger.get_instance()
+    logger.set_debug_mode(p._debug_mode)
+    logger.set_trace_mode(p._trace_mode)
     server = SimpleXMLRPCServer(("0.0.0.0", p._server_port), allow_none=True)
 
     tellieCommands = SerialCommand()
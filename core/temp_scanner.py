@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# temp_scanner
+#
+# TempScanner
+#
+# Thread that cycles through all the temperature
+# probes while the tellie control box is idle,
+# keeping a fixed length history for each probe.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import collections
+import threading
+import time
+from common import parameters as p
+from common import tellie_logger
+
+
+class TempScanner(threading.Thread):
+    """Read each probe in turn, one full cycle every interval seconds.
+    Probes are only read when the box is not firing and no other
+    command is using the serial port.
+    """
+
+    def __init__(self, tellie_serial, interval=p._temp_scan_interval, history=p._temp_history):
+        super(TempScanner, self).__init__(name="TempScanner")
+        self.daemon = True
+        self._tellie_serial = tellie_serial
+        self._interval = interval
+        self._probes = range(1, int(p._max_temp_probe) + 1)
+        self._readings = {}
+        for probe in self._probes:
+            self._readings[probe] = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.logger = tellie_logger.TellieLogger.get_instance()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        pause = float(self._interval) / len(self._probes)
+        while not self._stop_event.is_set():
+            for probe in self._probes:
+                # Wait for the box to be idle, sleeping rather than spinning
+                while not self._read_probe(probe):
+                    if self._stop_event.wait(p._short_pause):
+                        return
+                if self._stop_event.wait(pause):
+                    return
+
+    def _read_probe(self, probe):
+        """Read a probe if the box is idle, returns False if it was busy"""
+        tellie_serial = self._tellie_serial
+        if not tellie_serial._lock.acquire(False):
+            return False
+        try:
+            # Firing, or a PIN readout still to be read
+            if tellie_serial._firing or tellie_serial._reading:
+                return False
+            tellie_serial.select_temp_probe(probe)
+            temp = tellie_serial.read_temp()
+        except Exception, e:
+            self.logger.warn("Temperature scan failed for probe %d: %s" % (probe, e))
+            return True
+        finally:
+            tellie_serial._lock.release()
+        with self._lock:
+            self._readings[probe].append((time.time(), temp))
+        return True
+
+    def get_temperatures(self, since=0):
+        """Get the (time, temperature) readings after since for each
+        probe, keyed by probe string (for xmlrpc).
+        """
+        temperatures = {}
+        with self._lock:
+            for probe in self._probes:
+                readings = [reading for reading in self._readings[probe] if reading[0] > since]
+                if readings:
+                    temperatures[str(probe)] = readings
+        return temperatures
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+#
+# transaction_engine
+#
+# Transaction, TransactionEngine
+#
+# Runs the (command, buffer_check) pairs built in
+# tellie_server as transactions on the serial port:
+# each is written chunk by chunk as the echo comes back,
+# optionally waits for the readout that follows (PIN,
+# temperature or end of sequence), and has its own
+# timeout and can be cancelled.
+#
+# The engine has no thread: the port is read by whoever
+# waits, so one thread can keep several transactions
+# going, e.g. wait for a sequence readout while running
+# other commands:
+#
+#   engine = transaction_engine.TransactionEngine(port)
+#   fire = engine.submit(Transaction(p._cmd_fire_average_lower, '',
+#                                    expect=serial_reader.PIN, timeout=60))
+#   temp = engine.submit(...)
+#   engine.run([temp])          # fire is still waiting
+#   engine.run([fire])
+#
+# It also waits like a SerialReader (read_echo, wait_for,
+# drain), so SerialCommand can use it in place of the
+# reader thread.
+#
+# Written for Python 2, so no asyncio: the event loop is
+# a select/poll loop over the port.
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import collections
+import select
+import serial_reader
+from common import parameters as p
+
+# Transaction states
+PENDING = "pending"       # queued, nothing written yet
+SENDING = "sending"       # written (some chunks), reading the echo
+WAITING = "waiting"       # echo read, waiting for the readout
+DONE = "done"
+TIMED_OUT = "timed_out"
+CANCELLED = "cancelled"
+
+
+class TransactionError(Exception):
+    """A transaction did not complete"""
+
+    def __init__(self, error, transaction):
+        Exception.__init__(self, error)
+        self.transaction = transaction
+
+
+class TransactionTimeout(TransactionError):
+    pass
+
+
+class TransactionCancelled(TransactionError):
+    pass
+
+
+class Transaction(object):
+    """A command, its expected echo and optionally the readout after it.
+
+    command is a string or list of chunks, each written once the echo of
+    the previous one has arrived.  buffer_check is the echo expected,
+    either a list with the echo of each chunk or a string echoed after
+    the last chunk (defaults to each chunk echoed as sent, '' for none).
+    expect is a serial_reader event kind to wait for once the echo is
+    read, the event is then the result.  timeout covers the whole
+    transaction.
+    """
+
+    def __init__(self, command, buffer_check=None, expect=None, timeout=p._port_timeout):
+        if type(command) is str:
+            command = [command]
+        self.command = command
+        if buffer_check is None:
+            buffer_check = list(command)
+        elif type(buffer_check) is str:
+            buffer_check = [''] * (len(command) - 1) + [buffer_check]
+        self.buffer_check = ''.join(buffer_check)
+        # Length of the echo once each chunk has been echoed
+        self.offsets = []
+        for echo in buffer_check:
+            self.offsets.append(len(echo) + (self.offsets[-1] if self.offsets else 0))
+        self.expect = expect
+        self.timeout = timeout
+        self.state = PENDING
+        self.echo = ''
+        self.event = None
+        self.deadline = None
+        self.written = 0    # chunks written
+
+    def done(self):
+        return self.state in (DONE, TIMED_OUT, CANCELLED)
+
+    def cancel(self):
+        """Cancel, unless already finished.  Chunks not yet written never will be."""
+        if not self.done():
+            self.state = CANCELLED
+
+    def result(self):
+        """The readout event if one was expected, otherwise the echo"""
+        if self.state == CANCELLED:
+            raise TransactionCancelled("Transaction cancelled: %r" % (self.command,), self)
+        if self.state == TIMED_OUT:
+            raise TransactionTimeout("Transaction timed out: %r, echo %r" % (self.command, self.echo), self)
+        if self.state != DONE:
+            raise TransactionError("Transaction not finished: %r" % (self.command,), self)
+        return self.event if self.expect else self.echo
+
+
+class TransactionEngine(serial_reader.SerialParser):
+    """Run transactions on a serial port, reading it from the calling thread.
+
+    Echoes are matched to transactions in order, so only one is sending
+    at a time; any number may be waiting for their readouts.  Deadlines
+    and waits go by clock (see common/clock.py).
+    """
+
+    def __init__(self, serial_port, write=None, ring_size=p._reader_ring_size, clock=None):
+        serial_reader.SerialParser.__init__(self, serial_port, ring_size, clock)
+        self._write = write or serial_port.write
+        self._pending = collections.deque()
+        self._sending = None
+        self._waiting = []
+        self._last_data = 0.
+        try:
+            self._fileno = serial_port.fileno()
+        except Exception:
+            # e.g. an in-process port, polled instead
+            self._fileno = None
+
+    def stop(self):
+        """Nothing to stop, for the SerialReader interface"""
+        pass
+
+    def join(self, timeout=None):
+        pass
+
+    def submit(self, transaction):
+        """Queue a transaction, returns it"""
+        with self._condition:
+            self._pending.append(transaction)
+            self._step()
+        return transaction
+
+    def run(self, transactions, abort=None):
+        """Read the port until the transactions have finished, cancelling
+        them all if abort() becomes true.  Returns the transactions.
+        """
+        with self._condition:
+            while True:
+                self._step()
+                if all(t.done() for t in transactions):
+                    return transactions
+                if abort and abort():
+                    for t in transactions:
+                        t.cancel()
+                    continue
+                self._pump(self._next_timeout())
+
+    def transact(self, transaction, abort=None):
+        """Run one transaction, returns its result"""
+        self.submit(transaction)
+        self.run([transaction], abort)
+        return transaction.result()
+
+    def _next_timeout(self):
+        """Longest wait before a transaction needs attention (select
+        returns as soon as data arrives, so this only bounds how late a
+        deadline or abort is noticed)
+        """
+        timeout = p._short_pause
+        now = self._clock.time()
+        for t in [self._sending] + self._waiting:
+            if t is not None and t.deadline is not None:
+                timeout = min(timeout, max(t.deadline - now, 0))
+        return timeout
+
+    def _step(self):
+        """Move every transaction on as far as the data read allows"""
+        now = self._clock.time()
+        while True:
+            if self._sending is None and not self._start_next(now):
+                break
+            if not self._advance(now):
+                break
+        for t in list(self._waiting):
+            if t.state != CANCELLED:
+                t.event = self._pop(t.expect)
+                if t.event is not None:
+                    if t.expect == serial_reader.PIN:
+                        # A sequence readout follows its end marker
+                        self._pop(serial_reader.END_SEQUENCE)
+                    t.state = DONE
+                elif now >= t.deadline:
+                    t.state = TIMED_OUT
+            if t.done():
+                self._waiting.remove(t)
+
+    def _start_next(self, now):
+        """Start the next pending transaction, False if there is none"""
+        while self._pending:
+            t = self._pending.popleft()
+            if t.state == CANCELLED:
+                continue
+            t.deadline = now + t.timeout
+            t.state = SENDING
+            self._sending = t
+            self.expect_echo(len(t.buffer_check))
+            if t.expect == serial_reader.TEMP:
+                self.expect_temp()
+            return True
+        return False
+
+    def _advance(self, now):
+        """Write the sending transaction's chunks as their echoes arrive,
+        returns True once it is no longer sending.
+        """
+        t = self._sending
+        if t.state == CANCELLED:
+            # The echo of any chunks written is left to be drained
+            self._sending = None
+            return True
+        # Next chunk once the echo of the last has arrived
+        while t.written < len(t.command) and (t.written == 0 or len(self._echo) >= t.offsets[t.written-1]):
+            self._write(t.command[t.written])
+            t.written += 1
+        n = len(t.buffer_check)
+        if t.written == len(t.command) and len(self._echo) >= n:
+            t.echo, self._echo = self._echo[:n], self._echo[n:]
+            self._echo_expected = 0
+            if t.expect:
+                t.state = WAITING
+                self._waiting.append(t)
+            else:
+                t.state = DONE
+        elif now >= t.deadline:
+            # Hand over the echo so far, the rest is still expected as
+            # echo (not tokenised as readouts) and can be read with read_echo
+            t.echo, self._echo = self._echo, ''
+            t.state = TIMED_OUT
+        else:
+            return False
+        self._sending = None
+        return True
+
+    def _pump(self, timeout):
+        """Wait up to timeout for data, and parse it"""
+        waiting = self._serial.inWaiting()
+        if not waiting:
+            if self._fileno is not None:
+                select.select([self._fileno], [], [], timeout)
+            else:
+                self._clock.sleep(min(timeout, p._echo_poll))
+            waiting = self._serial.inWaiting()
+        if waiting:
+            self._last_data = self._clock.time()
+            self._feed(self._serial.read(waiting))
+        elif self._record and self._clock.time() - self._last_data > p._port_timeout:
+            # Readouts without a line ending are complete once the line goes quiet
+            self._feed('')
+
+    def _poll(self):
+        self._pump(0)
+        self._step()
+
+    def _wait(self, timeout):
+        self._pump(min(timeout, p._short_pause))
+        self._step()
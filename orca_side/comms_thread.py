@@ -19,6 +19,8 @@ import time
 import threading
 from common import parameters as p
 from common import tellie_logger
+from common import rpc_client
+from common import fire_plan
 from core import tellie_exception
 import comms_thread_pool
 import Tkinter
@@ -74,8 +76,10 @@ class LoadFireThread(CommsThread):
             self.database = None
 
     def attempt_stop(self):
-        '''Try to stop the tellie server.
+        '''Try to stop the tellie server, unless the GUI already has.
         '''
+        if self.stopped():
+            return
         try:
             self.server.stop()
         except xmlrpclib.Fault, e:
@@ -83,108 +87,54 @@ class LoadFireThread(CommsThread):
             pass
 
     def run(self):
-        """Expect two python dicts with settings.  Should calculate a
-        reasonable time delay from which PINOUT reads should be called.
+        """Expect two python dicts with settings.  Loads the channel
+        settings, then fires the plan a segment at a time, so a stop is
+        seen between segments even on a single threaded server.
         """
         load_settings = self.tellie_options.get_load_settings()
         fire_settings = self.tellie_options.get_fire_settings()
-        pin_readings = {}
-        #first load the settings
-        for chan in load_settings:
-            try:
-                # TODO: compact these and the fire settings into an init_channel call
-                self.server.select_channel(chan)
-                self.server.set_pulse_height(load_settings[chan]["pulse_height"])
-                self.server.set_pulse_width(load_settings[chan]["pulse_width"])
-                self.server.set_fibre_delay(load_settings[chan]["fibre_delay"])
-            except xmlrpclib.Fault, e:
-                self.attempt_stop()
-                self.save_errors("COMMUNICATION ERROR: %s" % e.faultString)
-                self.shutdown_thread(True, "COMMUNICATION ERROR: %s" % (e.faultString))
-                return
+        #first load the settings, all channels in one request
+        try:
+            batch = rpc_client.Batch(self.server)
+            for chan in load_settings:
+                batch.set_settings([["channel", chan],
+                                    ["pulse_height", load_settings[chan]["pulse_height"]],
+                                    ["pulse_width", load_settings[chan]["pulse_width"]],
+                                    ["fibre_delay", load_settings[chan]["fibre_delay"]]])
+            list(batch())
+        except xmlrpclib.Fault, e:
+            self.attempt_stop()
+            self.save_errors("COMMUNICATION ERROR: %s" % e.faultString)
+            self.shutdown_thread(True, "COMMUNICATION ERROR: %s" % (e.faultString))
+            return
         #now fire the channels
-        rate = float(self.tellie_options.get_pr())
-        #sequence mode, additional 200us delay
-        pin_readings = []
-        sub_pulses = []
-        total_pulses = 0
-        for fire in fire_settings:
-            total_pulses += fire["pulse_number"]
-            t_wait = fire["pulse_number"] * (1./rate + 200e-6)
+        results = []
+        for segment in fire_settings:
             if self.stopped(): #check at before sending any commands
                 self.attempt_stop()
                 self.save_errors("CALLED STOP")
                 self.shutdown_thread(True, "CALLED STOP!")
                 return
+            self.ellie_field.show_running()
             try:
                 # TODO: add in handling of multiple channels
-                self.server.select_channel(fire["channels"][0])
-                self.server.set_pulse_number(fire["pulse_number"])
-                self.server.set_pulse_delay(fire["pulse_delay"])
-                self.server.set_trigger_delay(fire["trigger_delay"])
-                self.server.fire_sequence()
-                t_start = time.time()
-            except xmlrpclib.Fault, e:
-                self.attempt_stop()
-                self.save_errors("COMMUNICATION ERROR: %s" % (e.faultString))
-                self.shutdown_thread(True, "COMMUNICATION ERROR: %s" % (e.faultString))
-                return
-            t_now = time.time()
-            while (t_now - t_start) < t_wait:
-                self.ellie_field.show_running()
-                time.sleep(p._short_pause)
-                if not self.stopped():
-                    t_now = time.time()
-                else:
-                    self.attempt_stop()
-                    self.save_errors("CALLED STOP")
-                    self.shutdown_thread(True, "CALLED STOP!")
-                    return
-            try:
-                pin_out = None
-                while (pin_out == None):
-                    try:
-                        pin_out, rms, channel_list = self.server.read_pin_sequence()
-                    except TypeError:
-                        pin_out = None
+                # Returns once the segment's sequence has ended
+                results += self.server.fire_plan([segment])["segments"]
             except xmlrpclib.Fault, e:
                 self.attempt_stop()
                 self.save_errors("READ ERROR: %s" % (e.faultString))
                 self.shutdown_thread(True, "READ ERROR: %s" % (e.faultString))
                 return
-            ## Commented this ridiculously old code (Martti, Oct 2017)
-            #while not pin_out:
-            #    time.sleep(p._short_pause)
-            #    if self.stopped():
-            #        #Stop the thread here!
-            #        self.attempt_stop()
-            #        self.save_errors("CALLED STOP")
-            #        self.shutdown_thread(1, "CALLED STOP!")
-            #        return
-            #    try:
-            #        pin_out, channel_list = self.server.read_pin_sequence()
-            #    except xmlrpclib.Fault, e:
-            #        self.attempt_stop()
-            #        self.save_errors("READ ERROR: %s" % (e.faultString))
-            #        self.shutdown_thread(True, "READ ERROR: %s" % (e.faultString))
-            #        return
-            pin_readings.append(pin_out)
-            sub_pulses.append(fire["pulse_number"])
+        plan = fire_plan.combine_segments(results)
+        pin_readings = []
+        sub_pulses = []
+        for segment in plan["segments"]:
+            pin_readings.append({segment["channel"]: segment["pin"]})
+            sub_pulses.append(segment["pulse_number"])
 
         self.ellie_field.show_waiting()
         self.save_results(sub_pulses, pin_readings)
-        average_pin = {}
-        for i, pins in enumerate(pin_readings):
-            print "PINS", pin_readings
-            for channel in pins:
-                if channel not in average_pin:
-                    average_pin[channel] = 0
-                print "CH:", channel, type(channel)
-                print "PI", pins
-                print "FI", fire_settings
-                print "TO", total_pulses
-                average_pin[channel] += float(pins[channel] * fire_settings[i]["pulse_number"]) / float(total_pulses)
-        self.shutdown_thread(message="Sequence complete, PIN: %s"%(average_pin))
+        self.shutdown_thread(message="Sequence complete, PIN: %s, RMS: %s" % (plan["pin"], plan["rms"]))
 
     def shutdown_thread(self, error_flag=None, message=None):
         if error_flag:
@@ -21,6 +21,7 @@ import json
 import time
 import math
 import copy
+import threading
 import argparse
 import Tkinter
 import tkMessageBox
@@ -29,6 +30,7 @@ import comms_thread
 import comms_thread_pool
 import tellie_database
 from common import tellie_logger
+from common import rpc_client
 from common import parameters as p
 
 class TellieOptions(object):
@@ -100,10 +102,10 @@ class TellieOptions(object):
         fd = float(self.get_fd())
         #ensure ability to pulse more than 65025 pulses
         n_max_pn, final_pn = self.get_pn_sequence(pn)
-        adjusted_pn, actual_pn, _, _ = parameters.pulse_number(final_pn)
-        total_pn = n_max_pn * parameters.max_pulse_number + actual_pn
-        adjusted_td, actual_td, _ = parameters.trigger_delay(td)
-        adjusted_fd, actual_fd, _ = parameters.fibre_delay(fd)
+        adjusted_pn, actual_pn, _, _ = p.pulse_number(final_pn)
+        total_pn = n_max_pn * p._max_pulse_number + actual_pn
+        adjusted_td, actual_td, _ = p.trigger_delay(td)
+        adjusted_fd, actual_fd, _ = p.fibre_delay(fd)
         if adjusted_pn is True:
             self.pn_tkstr.set(total_pn)
             messages += ["Pulse number adjusted from %d to %s" % (pn, total_pn)]
@@ -120,8 +122,8 @@ class TellieOptions(object):
     def get_pn_sequence(self, pn):
         """Get the number of pulses required
         """
-        n_max_pn = int(pn / parameters.max_pulse_number)
-        final_pn = pn % parameters.max_pulse_number
+        n_max_pn = int(pn / p._max_pulse_number)
+        final_pn = pn % p._max_pulse_number
         return n_max_pn, final_pn
 
     def get_load_settings(self):
@@ -143,7 +145,7 @@ class TellieOptions(object):
         load_dicts = []
         for i in range(n_max_pn):
             load_dicts.append(copy.copy(basic_dict))
-            load_dicts[i]["pulse_number"] = copy.copy(parameters.max_pulse_number)
+            load_dicts[i]["pulse_number"] = copy.copy(p._max_pulse_number)
         load_dicts.append(copy.copy(basic_dict))
         load_dicts[-1]["pulse_number"] = copy.copy(final_pn)
         return load_dicts
@@ -413,28 +415,30 @@ class OrcaGui(Tkinter.Tk):
 #                print "Unable to start thread!"
         self.ellie_field.show_waiting()
 
-    def stop_fire(self):
+    def stop_fire(self, report=True):
         thread_pool = comms_thread_pool.CommsThreadPool.get_instance()
         if thread_pool.get_thread_by_name("LOADnFIRE"):
-            #need to send a stop flag to the thread
-            self.message_field.show_message("STOPPING...")
+            #need to send a stop flag to the thread, no need to wait for it:
+            #it checks the flag between segments
             self.lf_thread.stop()
-            ctr = 1
-            while thread_pool.get_thread_by_name("LOADnFIRE"):
-                ctr += 1
-                if ctr > 100000:#large number...
-                    break
-            print "THREADS:", thread_pool._threads
-        # We should attempt a stop here as well
+        self.message_field.show_message("STOPPING...")
+        #the stop may wait behind a segment on a single threaded server,
+        #so send it from a thread rather than block the GUI
+        threading.Thread(target=self._send_stop, args=(report,), name="STOP").start()
+
+    def _send_stop(self, report):
         try:
             self.tellie_server.stop()
         except xmlrpclib.Fault, e:
-            self.message_field.show_warning("ERROR ON STOP COMMAND!")
+            if report:
+                self.message_field.show_warning("ERROR ON STOP COMMAND!")
         else:
-            self.message_field.show_message("STOPPED")
+            if report:
+                self.message_field.show_message("STOPPED")
 
     def safe_exit(self):
-        self.stop_fire()
+        # The stop thread outlives the GUI, so must not report to it
+        self.stop_fire(report=False)
         self.destroy()
 
 
@@ -458,7 +462,7 @@ if __name__ == "__main__":
             database.login(args.dbserver, args.dbname)
         except ImportError:
             print "WARNING: cannot use TELLIE DB"
-    tellie_server = xmlrpclib.Server("http://%s:%s" % (args.address, args.port))
+    tellie_server = rpc_client.server_proxy(args.address, args.port)
     app = OrcaGui(None, tellie_server, "orca_side/PRESETS.js", "orca_side/CHANNELS.js")
     app.title = "TELLIE Control"
     try:
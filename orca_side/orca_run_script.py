@@ -25,18 +25,8 @@ if __name__=="__main__":
         tellie_server.select_channel(args.channel)
         tellie_server.init_channel(args.channel, args.pulse_number, args.pulse_delay, args.trigger_delay,
                                    args.pulse_width, args.pulse_height, args.fibre_delay)
-        tellie_server.fire_sequence()
-	try: 
-	    print "Waiting for sequence to finish..."
-            mean = None
-            while (mean == None):
-                try:
-                    mean, rms, chan = tellie_server.read_pin_sequence()
-                except TypeError:
-                    mean = None
-    	except xmlrpclib.Fault, e:
-	    # Attempt a safe stop and inform in the return type as to the success?
-	    tellie_server.stop()
+        print "Waiting for sequence to finish..."
+        mean, rms, chan = tellie_server.fire_sequence_and_read()
     except xmlrpclib.Fault, e:
         # Attempt a safe stop and inform in the return type as to the success?
         tellie_server.stop()
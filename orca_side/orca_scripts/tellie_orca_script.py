@@ -1,8 +1,8 @@
 #!/usr/bin/env python
 import argparse
 import xmlrpclib
-import time
 from common import parameters as p
+from common import rpc_client
 
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
@@ -16,27 +16,21 @@ if __name__=="__main__":
                         help='an integer for the accumulator')
     args = parser.parse_args()
 
-    # TODO - Have the server proxy string interpreted from the parameters file tellie.cfg
-    tellie_server= xmlrpclib.ServerProxy('http://localhost:5030', allow_none = True)
+    tellie_server = rpc_client.server_proxy("localhost", p._server_port)
     try:
-        print tellie_server.select_channel(10)
-        print tellie_server.set_pulse_height(p._max_pulse_height)
-        print tellie_server.set_pulse_width(0)
-        print tellie_server.set_fibre_delay(0)
-        print tellie_server.set_trigger_delay(0)
-        print tellie_server.set_pulse_delay(1.0)
-        print tellie_server.set_pulse_number(100)
-        print tellie_server.fire_sequence()
-        time.sleep(p._long_pause)
-        time.sleep(p._long_pause)
-#        print tellie_server.fire_single()
-        print "reading..."
-        pin = None
-        while (pin == None):
-            try:
-                pin, rms, chan = tellie_server.read_pin_sequence()
-            except TypeError:
-                pin = None
+        # Load and fire in one request
+        batch = rpc_client.Batch(tellie_server)
+        batch.select_channel(10)
+        batch.set_pulse_height(p._max_pulse_height)
+        batch.set_pulse_width(0)
+        batch.set_fibre_delay(0)
+        batch.set_trigger_delay(0)
+        batch.set_pulse_delay(1.0)
+        batch.set_pulse_number(100)
+        batch.fire_sequence_and_read()
+        for result in batch():
+            print result
+        pin, rms, chan = result
         print pin, rms, chan
         print "DONE"
     except xmlrpclib.Fault, e:
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# tellie_socket_script.py
+#
+# Load, fire and read out one channel over the Orca
+# socket protocol (see common/comms_flags.py), served
+# by bin/tellie.py -o <port>.
+#
+#############################################
+
+import json
+import socket
+import argparse
+from common import comms_flags
+from common import parameters as p
+
+
+def send_request(conn, reader, flag, settings=None):
+    """Send a request, returns the response flag and its detail (or None)"""
+    request = flag
+    if settings is not None:
+        request += "|" + json.dumps(settings)
+    conn.sendall(request + "\n")
+    response = reader.readline()
+    if not response:
+        raise socket.error("Connection closed by tellie")
+    response = response.rstrip("\n")
+    if "|" in response:
+        return response.split("|", 1)
+    return response, None
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser("Usage: tellie_socket_script.py <options>")
+    parser.add_argument("-c", dest="channel", type=int, default=1, help="Select the TELLIE channel [1]")
+    parser.add_argument("-n", dest="pulse_number", type=int, default=1, help="Set the number of pulses [1]")
+    parser.add_argument("-d", dest="pulse_delay", type=float, default=1.0, help="Set the pulse delay (ms) [1.0]")
+    parser.add_argument("-t", dest="trigger_delay", type=int, default=0, help="Set the trigger delay [0]")
+    parser.add_argument("-w", dest="pulse_width", type=int, default=p._max_pulse_width, help="Set the pulse width (intensity)")
+    parser.add_argument("-z", dest="pulse_height", type=int, default=p._max_pulse_height, help="Set the pulse height (intensity)")
+    parser.add_argument("-x", dest="fibre_delay", type=float, default=0, help="Set the individual fibre delay offset [0]")
+    parser.add_argument("-s", dest="server", default="localhost", help="Server address to use [localhost]")
+    parser.add_argument("-p", dest="port", type=int, default=p._orca_port, help="Orca socket port")
+    args = parser.parse_args()
+
+    conn = socket.create_connection((args.server, args.port))
+    reader = conn.makefile("r")
+    try:
+        flag, detail = send_request(conn, reader, comms_flags.orca_init,
+                                    {str(args.channel): {"pulse_height": args.pulse_height,
+                                                         "pulse_width": args.pulse_width,
+                                                         "fibre_delay": args.fibre_delay}})
+        if flag != comms_flags.tellie_ready:
+            raise Exception("Could not load settings: %s %s" % (flag, detail))
+        flag, detail = send_request(conn, reader, comms_flags.orca_fire,
+                                    {"channels": [args.channel],
+                                     "pulse_number": args.pulse_number,
+                                     "pulse_delay": args.pulse_delay,
+                                     "trigger_delay": args.trigger_delay})
+        if flag != comms_flags.tellie_firing:
+            raise Exception("Could not fire: %s %s" % (flag, detail))
+        # Answered once the sequence has ended
+        flag, detail = send_request(conn, reader, comms_flags.orca_read)
+        while flag == comms_flags.tellie_notready:
+            flag, detail = send_request(conn, reader, comms_flags.orca_read)
+        if flag != comms_flags.tellie_pinout:
+            raise Exception("Could not read the PIN: %s %s" % (flag, detail))
+        print json.loads(detail)
+        print send_request(conn, reader, comms_flags.orca_stats)[1]
+    except:
+        print "Error! attempting to stop safely"
+        send_request(conn, reader, comms_flags.orca_stop)
+        raise
+    finally:
+        conn.close()
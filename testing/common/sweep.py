@@ -10,30 +10,38 @@ import os
 from core import tellie_server
 from common import comms_flags
 import math
-import time
 try:
     import utils
 except:
     pass
 import sys
 from common import parameters as p
+from common import clock as tellie_clock
 
 serial_port = p._serial_port
 scope_name = p._scope_name
 _boundary = [0,1.5e-3,3e-3,7e-3,15e-3,30e-3,70e-3,150e-3,300e-3,700e-3,1000]
 _v_div = [1e-3,2e-3,5e-3,10e-3,20e-3,50e-3,100e-3,200e-3,500e-3,1.0,1000]
+_clock = tellie_clock.real_clock
 sc = None
 sc = tellie_server.SerialCommand(serial_port)
 
 #initialise sc here, faster options setting
 def start():
     global sc
-    sc = tellie_server.SerialCommand(serial_port)
+    # The reader thread needs real time
+    sc = tellie_server.SerialCommand(serial_port, use_reader=not _clock.virtual, clock=_clock)
 
 def set_port(port):
     global serial_port
     serial_port = port
 
+def set_clock(clock):
+    """Time source for the pauses (e.g. a VirtualClock with an emulated
+    box and scope), call start() afterwards"""
+    global _clock
+    _clock = clock
+
 def set_scope(scope):
     global scope_name
     if scope=="Tektronix3000" or scope=="LeCroy":
@@ -77,14 +85,8 @@ def get_min_volt(channel,height,width,delay,scope,scale=None,trigger=None,min_tr
     else:
         scope.set_trigger_mode("single")
         scope.enable_trigger()
-        time.sleep(p._short_pause)
-    sc.fire_sequence()
-    pin, rms = None, None
-    while pin==None:
-        try:
-            pin, rms, _ = sc.read_pin_sequence()
-        except TypeError:
-            pin = None
+        _clock.sleep(p._short_pause)
+    pin, rms, _ = sc.fire_sequence_and_read()
     print "PIN (min_volt):",pin
     #single pulse fired, read from the scope  
     if scope_name == "Tektronix3000":
@@ -116,11 +118,11 @@ def sweep(dir_out,file_out,box,channel,width,delay,scope,min_volt=None,min_trigg
     if scope_name=="Tektronix3000":
         # first, run a single acquisition with a forced trigger, effectively to clear the waveform
         scope.set_single_acquisition()
-        time.sleep(p._short_pause) #needed for now to get the force to work...
+        _clock.sleep(p._short_pause) #needed for now to get the force to work...
         scope._connection.send("trigger:state ready")
-        time.sleep(p._short_pause)
+        _clock.sleep(p._short_pause)
         scope._connection.send("trigger force")
-        time.sleep(p._short_pause)
+        _clock.sleep(p._short_pause)
     else:
         # Setup averaging and set to 0 averages
         scope.reset_averaging("A")
@@ -170,17 +172,8 @@ def sweep(dir_out,file_out,box,channel,width,delay,scope,min_volt=None,min_trigg
         scope.set_trigger(1, trigger, True)
     sc.set_pulse_number(pulse_number)
 
-    sc.fire_sequence()
-    #wait for the sequence to end
-    tsleep = pulse_number * (delay*1e-3 + 210e-6)
-    time.sleep(tsleep) #add the offset in
-    pin, rms = None, None
-    #while not comms_flags.valid_pin(pin,channel):
-    while pin==None:
-        try:
-            pin, rms, _ = sc.read_pin_sequence()
-        except TypeError:
-            pin = None
+    #returns once the sequence has ended
+    pin, rms, _ = sc.fire_sequence_and_read()
     print "PIN (sweep):",pin
     #should now have an averaged waveform
     directory = "%s/channel_%02d"%(dir_out,logical_channel)
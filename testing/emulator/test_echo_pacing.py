@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# test_echo_pacing.py
+#
+# Echo flow control of SerialCommand against the
+# emulated control box: each chunk of a settings batch
+# is written once the echo of the chunks before it has
+# been read, and chunks without an echo (the pulse delay
+# fraction) hold nothing up.  Run polling the port and
+# with the transaction engine in virtual time, and with
+# the reader thread in real time.
+#
+#   source env.sh
+#   python -m unittest discover -s testing/emulator
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import unittest
+from core import tellie_server
+from common import clock as tellie_clock
+from common import parameters as p
+
+
+class EchoPacingTests(object):
+    """Tests run for each way of reading the port"""
+
+    use_reader = False
+    use_engine = False
+    virtual = True
+
+    def setUp(self):
+        self.clock = tellie_clock.VirtualClock() if self.virtual else tellie_clock.real_clock
+        self.tellie = tellie_server.SerialCommand("emulator://?seed=1&time_scale=0.01", use_reader=self.use_reader,
+                                                  use_engine=self.use_engine, clock=self.clock)
+        self.port = self.tellie._serial
+        self.emulator = self.port.emulator
+        self.writes = []
+        write = self.port.write
+        def recorded_write(data):
+            # Bytes read back before each write
+            read = self.tellie.metrics.get_metrics()["counters"].get("bytes_read", 0)
+            self.writes.append((data, read))
+            return write(data)
+        self.port.write = recorded_write
+
+    def tearDown(self):
+        self.tellie.disconnect()
+
+    def _send(self, settings):
+        """Send a settings batch as one command, returns the time taken
+        and the echo expected after each chunk
+        """
+        command, buffer_check = [], []
+        for name, value in settings:
+            if name == "channel":
+                values = tellie_server.command_select_channel(value)
+            else:
+                values = tellie_server.setting_commands[name][0](value)
+            command, buffer_check = tellie_server.command_append((command, buffer_check), values)
+        self.writes = []
+        start = self.clock.time()
+        self.tellie._send_command(command, buffer_check=buffer_check)
+        return self.clock.time() - start, buffer_check
+
+    def _check_paced(self, echoes):
+        self.assertEqual(len(self.writes), len(echoes))
+        before = self.writes[0][1]
+        expected = 0
+        for (chunk, read), echo in zip(self.writes, echoes):
+            self.assertTrue(read - before >= expected,
+                            "%r written after %d echo chars, expected %d" % (chunk, read - before, expected))
+            expected += len(echo)
+
+    def test_pulse_delay_then_trigger_delay(self):
+        taken, echoes = self._send([("pulse_delay", 1.5), ("trigger_delay", 10)])
+        self._check_paced(echoes)
+        # Not held up waiting for an echo of the fraction
+        self.assertTrue(taken < p._short_pause, "took %.3f s" % taken)
+        self.assertEqual(self.emulator.pulse_delay, 1.5)
+        self.assertEqual(self.emulator.trigger_delay, 10)
+
+    def test_orders_take_as_long(self):
+        first, _ = self._send([("pulse_delay", 1.5), ("trigger_delay", 10)])
+        second, _ = self._send([("trigger_delay", 15), ("pulse_delay", 2.5)])
+        self.assertTrue(abs(first - second) < p._short_pause / 2, "%.3f s against %.3f s" % (first, second))
+
+    def test_multi_char_echoes(self):
+        # The channel select echoes three chars, the pulse width two for its last chunk
+        taken, echoes = self._send([("channel", 3), ("pulse_width", 1000), ("pulse_height", 2000),
+                                    ("pulse_number", 1000), ("pulse_delay", 1.0), ("fibre_delay", 0.5)])
+        self._check_paced(echoes)
+        self.assertEqual(self.emulator.channels, [3])
+        self.assertEqual(self.emulator.pulse_width[3], 1000)
+        self.assertEqual(self.emulator.pulse_height[3], 2000)
+        self.assertEqual(self.emulator.fibre_delay[3], 0.5)
+
+    def test_set_settings(self):
+        self.tellie.set_settings([("channel", 5), ("pulse_delay", 2.0), ("trigger_delay", 20),
+                                  ("pulse_width", 500), ("pulse_number", 100)])
+        self.assertEqual(self.tellie.get_settings_cache()["channel_settings"]["5"]["pulse_width"], 500)
+        self.assertEqual((self.emulator.pulse_delay, self.emulator.trigger_delay, self.emulator.pulse_number),
+                         (2.0, 20, 100))
+
+
+class PolledEchoPacingTest(EchoPacingTests, unittest.TestCase):
+    pass
+
+
+class EngineEchoPacingTest(EchoPacingTests, unittest.TestCase):
+    use_engine = True
+
+
+class ReaderEchoPacingTest(EchoPacingTests, unittest.TestCase):
+    use_reader = True
+    virtual = False
+
+
+if __name__ == "__main__":
+    unittest.main()
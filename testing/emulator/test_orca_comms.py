@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# test_orca_comms.py
+#
+# Round trips of the Orca socket protocol (see
+# common/comms_flags.py) through core/orca_comms.py to
+# the emulated control box.
+#
+#   source env.sh
+#   python -m unittest discover -s testing/emulator
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import asyncore
+import json
+import socket
+import threading
+import unittest
+from core import orca_comms
+from core import tellie_server
+from common import comms_flags
+from common import parameters as p
+
+_settings = {"3": {"pulse_height": 16000, "pulse_width": 1000, "fibre_delay": 0.5}}
+
+
+def _fire_settings(pulse_number=1000, pulse_delay=1.0):
+    return {"channels": [3], "pulse_number": pulse_number, "pulse_delay": pulse_delay, "trigger_delay": 0}
+
+
+class OrcaCommsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tellie_serial = tellie_server.SerialCommand("emulator://?seed=1&time_scale=0.01", use_reader=False)
+        cls.server = orca_comms.TellieServer("localhost", 0, cls.tellie_serial)
+        cls.address = cls.server.socket.getsockname()
+        cls.serving = True
+        cls.thread = threading.Thread(target=cls._serve)
+        cls.thread.daemon = True
+        cls.thread.start()
+
+    @classmethod
+    def _serve(cls):
+        # As orca_comms.serve, until the tests are done
+        while cls.serving:
+            asyncore.loop(timeout=p._orca_poll, count=1)
+            orca_comms.send_completed()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.serving = False
+        cls.thread.join()
+        asyncore.close_all()
+        cls.tellie_serial.disconnect()
+
+    def setUp(self):
+        self.conn = socket.create_connection(self.address)
+        self.conn.settimeout(p._orca_read_timeout + 5)
+        self.reader = self.conn.makefile("r")
+
+    def tearDown(self):
+        self.reader.close()
+        self.conn.close()
+
+    def _request(self, flag, settings=None):
+        self.conn.sendall(flag + ("|" + json.dumps(settings) if settings is not None else "") + "\n")
+        return self._response()
+
+    def _response(self):
+        return self.reader.readline().rstrip("\n")
+
+    def test_load_fire_read(self):
+        self.assertEqual(self._request(comms_flags.orca_init, _settings), comms_flags.tellie_ready)
+        self.assertEqual(self._request(comms_flags.orca_fire, _fire_settings()), comms_flags.tellie_firing)
+        flag, pin = self._request(comms_flags.orca_read).split("|")
+        self.assertEqual(flag, comms_flags.tellie_pinout)
+        self.assertTrue(json.loads(pin) > 0)
+        flag, stats = self._request(comms_flags.orca_stats).split("|", 1)
+        self.assertEqual(flag, comms_flags.tellie_stats)
+        stats = json.loads(stats)
+        self.assertEqual(stats["%s:%s" % self.conn.getsockname()],
+                         {"queued": 0, "in_flight": 0, "completed": 3})
+
+    def test_pipelined(self):
+        # All in one write, answered in order
+        requests = [comms_flags.orca_init + "|" + json.dumps(_settings),
+                    comms_flags.orca_fire + "|" + json.dumps(_fire_settings()),
+                    comms_flags.orca_read,
+                    "Z"]
+        self.conn.sendall("\n".join(requests) + "\n")
+        self.assertEqual(self._response(), comms_flags.tellie_ready)
+        self.assertEqual(self._response(), comms_flags.tellie_firing)
+        self.assertTrue(self._response().startswith(comms_flags.tellie_pinout + "|"))
+        self.assertEqual(self._response(), comms_flags.tellie_error + "|Unknown input!")
+
+    def test_stats_while_reading(self):
+        self.assertEqual(self._request(comms_flags.orca_init, _settings), comms_flags.tellie_ready)
+        self.assertEqual(self._request(comms_flags.orca_fire, _fire_settings(50000, 10.)),
+                         comms_flags.tellie_firing)
+        other = socket.create_connection(self.address)
+        other_reader = other.makefile("r")
+        try:
+            self.conn.sendall(comms_flags.orca_read + "\n")
+            # The read waits for the readout, another connection sees it in flight
+            stats = {}
+            while stats.get("%s:%s" % self.conn.getsockname(), {}).get("in_flight") != 1:
+                other.sendall(comms_flags.orca_stats + "\n")
+                stats = json.loads(other_reader.readline().rstrip("\n").split("|", 1)[1])
+            self.assertEqual(stats["%s:%s" % self.conn.getsockname()],
+                             {"queued": 0, "in_flight": 1, "completed": 2})
+            other.sendall(comms_flags.orca_stop + "\n")
+            self.assertTrue(other_reader.readline().startswith(comms_flags.tellie_stopped))
+        finally:
+            other_reader.close()
+            other.close()
+        # Aborted if the stop came while it was checking for the readout,
+        # otherwise cancelled before it was retried
+        self.assertTrue(self._response() in (comms_flags.tellie_error + "|Stopped",
+                                             comms_flags.tellie_error + "|Cancelled by stop"))
+
+    def test_bad_settings(self):
+        response = self._request(comms_flags.orca_fire, {"channels": [3]})
+        self.assertTrue(response.startswith(comms_flags.tellie_error + "|"))
+        # The connection is still usable
+        self.assertEqual(self._request(comms_flags.orca_init, _settings), comms_flags.tellie_ready)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# test_transaction_engine.py
+#
+# Runs transactions against the emulated control box
+# (core/sno6c_emulator.py) in virtual time: echo paced
+# setting batches, cancelling and timing out.
+#
+#   source env.sh
+#   python -m unittest discover -s testing/emulator
+#
+# History:
+# 2026/10/18: First instance
+#
+###########################################
+###########################################
+
+import unittest
+from core import sno6c_emulator
+from core import serial_reader
+from core import tellie_server
+from core import transaction_engine
+from common import clock as tellie_clock
+from common import parameters as p
+
+
+class TransactionEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = tellie_clock.VirtualClock()
+        self.emulator = sno6c_emulator.SNO6CEmulator(seed=1, clock=self.clock.time)
+        self.port = sno6c_emulator.EmulatorPort(self.emulator, p._port_timeout, self.clock)
+        self.writes = []
+        self.engine = transaction_engine.TransactionEngine(self.port, self._write, clock=self.clock)
+
+    def _write(self, data):
+        self.writes.append((self.clock.time(), data))
+        return self.port.write(data)
+
+    def _batch(self, settings):
+        command, buffer_check = [], []
+        for name, value in settings:
+            command, buffer_check = tellie_server.command_append((command, buffer_check),
+                                                                 tellie_server.setting_commands[name][0](value))
+        return transaction_engine.Transaction(command, buffer_check)
+
+    def test_pulse_delay_then_trigger_delay(self):
+        # The pulse delay fraction is not echoed, the next chunk must not wait for it
+        transaction = self._batch([("pulse_delay", 1.5), ("trigger_delay", 10)])
+        start = self.clock.time()
+        echo = self.engine.transact(transaction)
+        self.assertEqual(echo, p._cmd_pulse_delay + p._cmd_trigger_delay)
+        self.assertEqual([data for _, data in self.writes], transaction.command)
+        self.assertEqual(self.writes[2][0], self.writes[1][0])
+        self.assertTrue(self.clock.time() - start < 3 * p._echo_latency)
+        self.assertEqual(self.emulator.pulse_delay, 1.5)
+        self.assertEqual(self.emulator.trigger_delay, 10)
+
+    def test_chunks_wait_for_their_echo(self):
+        # The channel select echoes three chars, the pulse width waits for all of them
+        command, buffer_check = tellie_server.command_append(tellie_server.command_select_channel(3),
+                                                             tellie_server.command_pulse_width(1000))
+        transaction = transaction_engine.Transaction(command, buffer_check)
+        self.assertEqual(transaction.offsets, [3, 4, 6])
+        self.assertEqual(self.engine.transact(transaction), ''.join(buffer_check))
+        self.assertTrue(self.writes[1][0] - self.writes[0][0] >= p._echo_latency)
+        self.assertEqual(self.emulator.pulse_width[3], 1000)
+
+    def test_cancel(self):
+        self.engine.transact(self._batch([("pulse_number", 1000), ("pulse_delay", 10.)]))
+        self.engine.transact(transaction_engine.Transaction(tellie_server.command_select_channel(3)[0],
+                                                            tellie_server.command_select_channel(3)[1]))
+        fire = transaction_engine.Transaction(p._cmd_fire_average_lower, '', expect=serial_reader.PIN,
+                                              timeout=60)
+        start = self.clock.time()
+        self.engine.run([self.engine.submit(fire)], lambda: self.clock.time() - start > 1.)
+        self.assertEqual(fire.state, transaction_engine.CANCELLED)
+        self.assertRaises(transaction_engine.TransactionCancelled, fire.result)
+        self.assertTrue(self.clock.time() - start < 1. + p._short_pause + p._echo_latency)
+
+    def test_cancel_before_start(self):
+        transaction = transaction_engine.Transaction(p._cmd_disable_ext_trig)
+        transaction.cancel()
+        self.engine.run([self.engine.submit(transaction)])
+        self.assertEqual(self.writes, [])
+        self.assertRaises(transaction_engine.TransactionCancelled, transaction.result)
+
+    def test_timeout(self):
+        self.emulator.faults[sno6c_emulator.DROP_ECHO] = 1.
+        transaction = self._batch([("trigger_delay", 10), ("pulse_number", 1000)])
+        transaction.timeout = 1.
+        start = self.clock.time()
+        self.engine.run([self.engine.submit(transaction)])
+        self.assertEqual(transaction.state, transaction_engine.TIMED_OUT)
+        self.assertRaises(transaction_engine.TransactionTimeout, transaction.result)
+        # Nothing echoed, so nothing after the first chunk was written
+        self.assertEqual(len(self.writes), 1)
+        self.assertTrue(1. <= self.clock.time() - start < 1. + p._short_pause + p._echo_latency)
+
+    def test_readout_timeout(self):
+        transaction = transaction_engine.Transaction(p._cmd_temp_read_lower, '', expect=serial_reader.TEMP,
+                                                     timeout=1.)
+        # No probe selected on an idle box, but the readout still comes
+        self.assertTrue(self.engine.transact(transaction).value > 0)
+        fire = transaction_engine.Transaction(p._cmd_fire_average_lower, '', expect=serial_reader.PIN,
+                                              timeout=1.)
+        self.engine.run([self.engine.submit(fire)])
+        # No channel selected, the box never reads out
+        self.assertEqual(fire.state, transaction_engine.TIMED_OUT)
+
+
+if __name__ == "__main__":
+    unittest.main()
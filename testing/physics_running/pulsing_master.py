@@ -10,22 +10,6 @@ def safe_exit(sc,e):
     sc.stop()
     sys.exit()
 
-def read_pin():
-    '''Wait keep looking for pin. It will be retuned when the sequence ends
-    '''
-    pin, rms = None, None
-    try:
-        while (pin == None):
-            try:
-                pin, rms, channel = sc.read_pin_sequence()
-            except TypeError:
-                pin = None
-    except Exception,e:
-        safe_exit(sc,e)
-    except KeyboardInterrupt:
-        print "Keyboard interrupt"
-    return int(pin), float(rms)
-
 def pulse_channel(sc,width,delay,number,channel):
     width = int(width)
     delay = float(delay)
@@ -41,17 +25,11 @@ def pulse_channel(sc,width,delay,number,channel):
     sc.set_pulse_width(width)
     sc.set_pulse_delay(delay)
     sc.set_pulse_number(number)
-    try:
-        sc.fire_sequence()
-    except Exception,e:
-        safe_exit(sc,e)
-    except KeyboardInterrupt:
-        safe_exit(sc,"keyboard interrupt")
-    
-    # Get PIN readout
+    # Fire and get PIN readout once the sequence ends
     mean = None
     try:
-        mean, rms = read_pin()
+        mean, rms, _ = sc.fire_sequence_and_read()
+        mean, rms = int(mean), float(rms)
     except Exception,e:
         safe_exit(sc,e)
     except KeyboardInterrupt:
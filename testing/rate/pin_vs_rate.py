@@ -7,26 +7,22 @@
 # channels and IPW settings
 ########################
 
-import time
+import ROOT
+from core import campaign_scheduler
 from core.tellie_server import SerialCommand
+from common import parameters as p
 
-sc = tellie_server.SerialCommand()
+sc = SerialCommand()
 offset = 19.6e-6 #additional offset in delay
 
-def run_settings(n_pulse,chan,delay,width):
-    delay_s = delay*1e-3
-    t_run = n_pulse * 1./(delay_s+offset)    
-    sc.select_channel(chan)
-    sc.set_pulse_number(n_pulse)
-    sc.set_pulse_delay(delay)
-    sc.set_pulse_height(p._max_pulse_height)
-    sc.set_pulse_width(width)
-    sc.fire()
-    time.sleep(t_run)
-    pin = sc.read_pin()
-    while pin==None:
-        pin = sc.read_pin()
-    return int(pin)
+def warm_up(previous, point):
+    '''Run the box for a while first to try to stabalise
+    the temperature, for each new channel/delay
+    '''
+    if previous is None or \
+            (previous["channel"], previous["pulse_delay"]) != (point["channel"], point["pulse_delay"]):
+        return [dict(point, pulse_width=p._max_pulse_width)]
+    return []
 
 if __name__=="__main__":
 
@@ -38,40 +34,34 @@ if __name__=="__main__":
     delays = [10.0,3.0,1.0,0.3,0.1]
     widths = [0,1000,2000,3000,4000,
               5000,6000,7000,8000,9000]
+    channels = range(1, 12*8+1)
 
-    for ibox in range(12):
-        box = ibox+1
-        for ichan in range(8):
+    for chan in channels:
+        tg[chan] = {}
+        for width in widths:
+            gname = "Chan%03d_Width%05d" %(chan,width)
+            tg[chan][width] = ROOT.TGraph()
+            tg[chan][width].SetName(gname)
 
-            print "Starting channel: %03d" % chan
+    # Let the scheduler choose the order, keeping each box together
+    points = campaign_scheduler.make_points(channels, widths, delays, [p._pulse_num],
+                                            pulse_height=p._max_pulse_height)
+    points = campaign_scheduler.schedule(points,
+                                         group_by=lambda point: (point["channel"]-1)/8,
+                                         warm_up=warm_up,
+                                         cache=sc.get_settings_cache())
 
-            chan = ibox*8 + ichan + 1
-            
-            tg[chan] = {}
-            for width in widths:
-                gname = "Chan%03d_Width%05d" %(chan,width)
-                tg[chan][width] = ROOT.TGraph()
-                tg[chan][width].SetName(gname)
+    def add_point(point, pin, rms):
+        print "Channel: %03d\tdelay: %.3f\twidth: %05d\tPIN: %s" % \
+            (point["channel"], point["pulse_delay"], point["pulse_width"], pin)
+        delay_actual = point["pulse_delay"] * 1e-3 + offset
+        graph = tg[point["channel"]][point["pulse_width"]]
+        graph.SetPoint(graph.GetN(), delay_actual, pin)
 
-            for delay in delays:
-                #run the box for a while first to try to stabalise
-                #the temperature
-                print "\tdelay: %.3f" % delay
+    campaign_scheduler.run_campaign(sc, points, add_point)
 
-                delay_actual = delay * 1e-3 + offset
-                _ = run_settings(n_pulse = p._pulse_num,
-                                 chan = chan,
-                                 delay = delay,
-                                 width = height(p._max_pulse_width))
-                for width in widths:
-                    pin = run_settings(n_pulse = p._pulse_num,
-                                       chan = chan,
-                                       delay = delay,
-                                       width = width)                    
-                    pt = tg[chan][width].GetN()
-                    tg[chan][width].SetPoint(pt,delay_actual,pin)
-    
-            for width in widths:
-                tg[chan][width].Write()
+    for chan in channels:
+        for width in widths:
+            tg[chan][width].Write()
 
     tf.Close()